@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from backend.clients import get_redis
+
+
+class ResponseCache:
+    """
+    Cache of serialized API responses stored in Redis.
+    Responses are keyed by blog and its data version, so bumping the version
+    (when blog data is updated) invalidates all cached responses of the blog
+    """
+    def __init__(self):
+        self.redis = get_redis()
+        self.ttl = settings.RESPONSE_CACHE_TTL
+        self.version_key = 'data-version-{}'
+        self.response_key = 'response-{}-{}-{}'
+
+    def get_version(self, blog_name: str) -> int:
+        """
+        Get current data version of the blog
+
+        :param blog_name: blog name
+        :return: version number
+        """
+        return int(self.redis.get(self.version_key.format(blog_name)) or 0)
+
+    def bump_version(self, blog_name: str) -> None:
+        """
+        Invalidate cached responses of the blog. Should be called whenever blog data changes
+
+        :param blog_name: blog name
+        """
+        self.redis.incr(self.version_key.format(blog_name))
+
+    def get(self, blog_name: str, version: int, path: str):
+        """
+        Get cached response payload
+
+        :param blog_name: blog name
+        :param version: data version of the blog got with get_version
+        :param path: full request path including query string
+        :return: payload or None if it's not cached
+        """
+        return self.redis.get(self.response_key.format(blog_name, version, path))
+
+    def set(self, blog_name: str, version: int, path: str, payload: bytes) -> None:
+        """
+        Cache response payload for data version of the blog. The version should be read
+        before building the payload, so a payload built from older data is never stored under newer version
+
+        :param blog_name: blog name
+        :param version: data version of the blog got with get_version
+        :param path: full request path including query string
+        :param payload: response payload
+        """
+        self.redis.set(self.response_key.format(blog_name, version, path), payload, ex=self.ttl)
+
+
+def _get_cache_keys(view, request) -> tuple:
+    get_blog_name = getattr(view, 'get_cache_blog_name', None)
+    blog_name = get_blog_name(request) if get_blog_name else request.GET.get('blog') or request.user.username
+    # Access to the blog is checked by the view, so responses are cached per user
+    path = '%s:%s' % (request.user.pk, request.get_full_path())
+    return blog_name, path
+
+
+def _make_response(request, payload: bytes) -> HttpResponse:
+    etag = '"%s"' % hashlib.md5(payload).hexdigest()
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(payload, content_type="application/json")
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cache_json_response(func):
+    """
+    Decorator for views returning JSON about user's blog, selected by `blog` parameter
+    (primary blog by default). Caches successful responses in Redis until blog data changes
+    and answers with 304 if client already has the same payload (ETag).
+    If the blog isn't given by `blog` parameter, the view should define `get_cache_blog_name(request)`
+    returning its name, or None to leave the response uncached. The method is always sync.
+    Should be used after login_required. Works with both sync and async views
+    """
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(self, request, *args, **kwargs):
+            cache = ResponseCache()
+            if hasattr(self, 'get_cache_blog_name'):
+                blog_name, path = await sync_to_async(_get_cache_keys)(self, request)
+            else:
+                blog_name, path = _get_cache_keys(self, request)
+            if blog_name is None:
+                return await func(self, request, *args, **kwargs)
+            version = await sync_to_async(cache.get_version, thread_sensitive=False)(blog_name)
+            payload = await sync_to_async(cache.get, thread_sensitive=False)(blog_name, version, path)
+            if payload is None:
+                response = await func(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                payload = response.content
+                await sync_to_async(cache.set, thread_sensitive=False)(blog_name, version, path, payload)
+            return _make_response(request, payload)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(self, request, *args, **kwargs):
+        cache = ResponseCache()
+        blog_name, path = _get_cache_keys(self, request)
+        if blog_name is None:
+            return func(self, request, *args, **kwargs)
+        version = cache.get_version(blog_name)
+        payload = cache.get(blog_name, version, path)
+        if payload is None:
+            response = func(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            payload = response.content
+            cache.set(blog_name, version, path, payload)
+        return _make_response(request, payload)
+    return wrapper
@@ -0,0 +1,129 @@
+import asyncio
+import atexit
+import http.cookiejar
+import threading
+import weakref
+from typing import Dict
+import dramatiq
+import httpx
+import requests
+from django.conf import settings
+from redis import BlockingConnectionPool
+from requests.adapters import HTTPAdapter
+from backend.instrumentation import InstrumentedRedis
+
+_lock = threading.Lock()
+_redis_pools: Dict[bool, BlockingConnectionPool] = {}
+_http_session = None
+_async_http_clients = weakref.WeakKeyDictionary()  # event loop: httpx.AsyncClient
+
+
+class RejectCookiesPolicy(http.cookiejar.DefaultCookiePolicy):
+    """
+    Cookie policy which neither stores nor sends cookies. HTTP clients are shared by requests
+    made on behalf of different users, so cookies set for one user must not leak to others
+    """
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+def get_redis(decode_responses: bool = False) -> InstrumentedRedis:
+    """
+    Get Redis client using connection pool shared by the whole process.
+    Clients are cheap to create, connections are reused between them
+
+    :param decode_responses: decode responses to str
+    :return: Redis client
+    """
+    pool = _redis_pools.get(decode_responses)
+    if pool is None:
+        with _lock:
+            pool = _redis_pools.get(decode_responses)
+            if pool is None:
+                # Blocking pool makes callers wait for a free connection instead of failing
+                pool = BlockingConnectionPool(max_connections=settings.REDIS_MAX_CONNECTIONS,
+                                              decode_responses=decode_responses, **settings.REDIS)
+                _redis_pools[decode_responses] = pool
+    return InstrumentedRedis(connection_pool=pool)
+
+
+def get_http_session() -> requests.Session:
+    """
+    Get HTTP session shared by the whole process, which keeps connections alive between requests.
+    The session doesn't keep cookies, as it's used on behalf of different users
+
+    :return: requests session
+    """
+    global _http_session
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                session = requests.Session()
+                session.cookies.set_policy(RejectCookiesPolicy())
+                adapter = HTTPAdapter(pool_maxsize=settings.HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _http_session = session
+    return _http_session
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Get asynchronous HTTP client shared by coroutines of the running event loop,
+    which keeps connections alive between requests. Connections can't be shared between loops,
+    so every loop gets its own client. The client doesn't keep cookies, as it's used on behalf of different users
+
+    :return: httpx client
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None:
+        limits = httpx.Limits(max_keepalive_connections=settings.HTTP_POOL_SIZE)
+        client = httpx.AsyncClient(limits=limits)
+        client.cookies.jar.set_policy(RejectCookiesPolicy())
+        _async_http_clients[loop] = client
+    return client
+
+
+async def close_async_http_client() -> None:
+    """
+    Close asynchronous HTTP client of the running event loop, if it was created.
+    Should be called before the loop is finished, e.g. on ASGI lifespan shutdown
+    """
+    client = _async_http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def close_clients() -> None:
+    """
+    Close pooled connections. Called on process exit, can be called to drop connections
+    which shouldn't be shared, e.g. after fork
+    """
+    global _http_session
+    with _lock:
+        for pool in _redis_pools.values():
+            pool.disconnect()
+        _redis_pools.clear()
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
+        # Asynchronous clients can only be closed in their event loops, see close_async_http_client
+        _async_http_clients.clear()
+
+
+atexit.register(close_clients)
+
+
+class ClientsMiddleware(dramatiq.Middleware):
+    """
+    Dramatiq middleware managing pooled clients of worker processes
+    """
+    def after_process_boot(self, broker):
+        close_clients()
+
+    def after_worker_shutdown(self, broker, worker):
+        close_clients()
@@ -0,0 +1,235 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+import dramatiq
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from redis import Redis
+from redis.client import Pipeline
+
+KINDS = ('sql', 'redis', 'tumblr')
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000, float('inf'))
+
+OPERATIONS = Counter(
+    'tumblrstats_operations_total', 'SQL queries, Redis commands and Tumblr API calls made',
+    ['kind', 'operation'],
+)
+OPERATION_SECONDS = Histogram(
+    'tumblrstats_operation_seconds', 'Duration of SQL queries, Redis commands and Tumblr API calls',
+    ['kind', 'operation'],
+)
+REQUEST_SECONDS = Histogram(
+    'tumblrstats_request_seconds', 'Duration of HTTP requests',
+    ['view', 'method', 'status'],
+)
+JOB_SECONDS = Histogram(
+    'tumblrstats_job_seconds', 'Duration of Dramatiq jobs',
+    ['actor', 'status'], buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, float('inf')),
+)
+UNIT_OPERATIONS = Histogram(
+    'tumblrstats_unit_operations', 'Operations made per HTTP request or Dramatiq job',
+    ['unit', 'name', 'kind'], buckets=COUNT_BUCKETS,
+)
+
+_local = threading.local()
+# Context variable follows coroutines of a request and is copied to threads running their synchronous code
+_tally = ContextVar('tally', default=None)
+
+
+class Tally:
+    """
+    Counts and total duration of operations made while handling a single HTTP request or job
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.seconds = dict.fromkeys(KINDS, 0.0)
+
+    def add(self, kind: str, seconds: float) -> None:
+        with self.lock:
+            self.counts[kind] += 1
+            self.seconds[kind] += seconds
+
+    def observe(self, unit: str, name: str) -> None:
+        """
+        Record operations counts of the unit of work in metrics
+
+        :param unit: 'request' or 'job'
+        :param name: view or actor name
+        """
+        for kind, count in self.counts.items():
+            UNIT_OPERATIONS.labels(unit, name, kind).observe(count)
+
+
+def get_tally() -> Optional[Tally]:
+    return _tally.get()
+
+
+@contextmanager
+def tracking(tally: Optional[Tally] = None):
+    """
+    Count operations made within the block to the tally
+
+    :param tally: tally to count to, new one by default
+    """
+    token = _tally.set(tally or Tally())
+    try:
+        yield _tally.get()
+    finally:
+        _tally.reset(token)
+
+
+def bind(func):
+    """
+    Make operations of the function count to the current tally when it's called from another thread
+
+    :param func: function to be called in a thread pool
+    :return: wrapped function
+    """
+    tally = get_tally()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if tally is None:
+            return func(*args, **kwargs)
+        with tracking(tally):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def measure(kind: str, operation: str):
+    """
+    Measure an operation made within the block
+
+    :param kind: one of KINDS
+    :param operation: operation name, e.g. SQL statement type or Redis command
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        OPERATIONS.labels(kind, operation).inc()
+        OPERATION_SECONDS.labels(kind, operation).observe(seconds)
+        tally = get_tally()
+        if tally is not None:
+            tally.add(kind, seconds)
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    with measure('sql', sql.split(None, 1)[0].upper() if sql else ''):
+        return execute(sql, params, many, context)
+
+
+def _install_sql_wrapper(sender, connection, **kwargs):
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+connection_created.connect(_install_sql_wrapper)
+
+
+class InstrumentedPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        with measure('redis', 'PIPELINE'):
+            return super().execute(raise_on_error)
+
+
+class InstrumentedRedis(Redis):
+    """
+    Redis client measuring every command. Pipelines are measured as a single operation
+    """
+    def execute_command(self, *args, **options):
+        with measure('redis', str(args[0]).upper()):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentationMiddleware:
+    """
+    Django middleware measuring requests. Counts and durations of operations made by the request
+    are sent in debug headers if INSTRUMENTATION_HEADERS setting is on.
+    Works both under WSGI and ASGI
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Make Django treat the middleware as a coroutine function, as it does for MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with tracking() as tally:
+            response = self.get_response(request)
+        return self._process(request, response, tally, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with tracking() as tally:
+            response = await self.get_response(request)
+        return self._process(request, response, tally, started)
+
+    @staticmethod
+    def _process(request, response, tally: Tally, started: float):
+        seconds = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unknown'
+        REQUEST_SECONDS.labels(view, request.method, response.status_code).observe(seconds)
+        tally.observe('request', view)
+        if settings.INSTRUMENTATION_HEADERS:
+            timings = ['%s;dur=%.2f;desc="%d calls"' % (kind, tally.seconds[kind] * 1000, tally.counts[kind])
+                       for kind in KINDS]
+            response['Server-Timing'] = ', '.join(timings + ['total;dur=%.2f' % (seconds * 1000)])
+            response['X-SQL-Queries'] = tally.counts['sql']
+            response['X-Redis-Calls'] = tally.counts['redis']
+            response['X-Tumblr-Calls'] = tally.counts['tumblr']
+        return response
+
+
+class JobInstrumentationMiddleware(dramatiq.Middleware):
+    """
+    Dramatiq middleware measuring jobs and operations made by them
+    """
+    def before_process_message(self, broker, message):
+        _tally.set(Tally())
+        _local.job_started = time.perf_counter()
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        tally = get_tally()
+        if tally is None:
+            return
+        seconds = time.perf_counter() - _local.job_started
+        JOB_SECONDS.labels(message.actor_name, 'failed' if exception is not None else 'done').observe(seconds)
+        tally.observe('job', message.actor_name)
+        _tally.set(None)
+
+    def after_skip_message(self, broker, message):
+        _tally.set(None)
+
+
+def metrics_view(request):
+    """
+    Metrics in Prometheus format. When processes share metrics through
+    `prometheus_multiproc_dir`, metrics of all of them are collected
+    """
+    registry = REGISTRY
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Hashable
+from django.conf import settings
+
+# Values memoized while handling the current request, None outside of requests
+_scope = ContextVar('memo_scope', default=None)
+# All process caches, so they can be cleared at once
+_caches = weakref.WeakSet()
+
+
+class TTLCache:
+    """
+    Cache of values kept by the process for a limited time.
+    Least recently used values are dropped above MEMO_CACHE_SIZE.
+    Values aren't shared between processes, so they should either be fine to be stale
+    until they expire or be stored along with a version checked on read
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = OrderedDict()
+        _caches.add(self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            item = self.values.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self.values[key]
+                return default
+            self.values.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        """
+        :param key: key
+        :param value: value
+        :param ttl: seconds to keep the value for, it isn't stored if ttl is 0
+        """
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.values[key] = (time.monotonic() + ttl, value)
+            self.values.move_to_end(key)
+            while len(self.values) > settings.MEMO_CACHE_SIZE:
+                self.values.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self.lock:
+            self.values.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.values.clear()
+
+
+def reset() -> None:
+    """
+    Drop values memoized by the process, in all caches and in the current request
+    """
+    for cache in list(_caches):
+        cache.clear()
+    scope = _scope.get()
+    if scope is not None:
+        scope.clear()
+
+
+@contextmanager
+def request_scope():
+    """
+    Memoize values with get_scoped/set_scoped within the block
+    """
+    token = _scope.set({})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def get_scoped(key: Hashable, default: Any = None) -> Any:
+    """
+    Get value memoized in the current request
+
+    :param key: key
+    :param default: value returned if nothing is memoized or there's no request
+    :return: value
+    """
+    scope = _scope.get()
+    if scope is None:
+        return default
+    return scope.get(key, default)
+
+
+def set_scoped(key: Hashable, value: Any) -> None:
+    """
+    Memoize value until the current request is finished. Does nothing outside of requests
+
+    :param key: key
+    :param value: value
+    """
+    scope = _scope.get()
+    if scope is not None:
+        scope[key] = value
+
+
+def discard_scoped(key: Hashable) -> None:
+    scope = _scope.get()
+    if scope is not None:
+        scope.pop(key, None)
+
+
+class RequestScopeMiddleware:
+    """
+    Django middleware opening a memoization scope for every request. Works both under WSGI and ASGI
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Make Django treat the middleware as a coroutine function, as it does for MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with request_scope():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with request_scope():
+            return await self.get_response(request)
@@ -22,6 +22,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.instrumentation.InstrumentationMiddleware',
+    'backend.memo.RequestScopeMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +52,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 if DEBUG and not os.getenv('USE_POSTGRES'):
     DATABASES = {
@@ -69,6 +72,8 @@ else:
         }
     }
 
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'  # type of implicit primary keys of existing tables
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -99,7 +104,37 @@ TUMBLR_CONSUMER_SECRET = os.getenv('TUMBLR_CONSUMER_SECRET')
 TUMBLR_REQUEST_TOKEN_URL = 'https://www.tumblr.com/oauth/request_token'
 TUMBLR_AUTHORIZATION_URL = 'https://www.tumblr.com/oauth/authorize'
 TUMBLR_ACCESS_TOKEN_URL = 'https://www.tumblr.com/oauth/access_token'
+TUMBLR_API_HOST = os.getenv('TUMBLR_API_HOST', 'https://api.tumblr.com')
+TUMBLR_RATE_LIMITS = {  # consumer key quotas, name: (requests, period in seconds)
+    'hour': (1000, 60 * 60),
+    'day': (5000, 24 * 60 * 60),
+}
+TUMBLR_USER_RATE_LIMITS = {  # quotas for calls on behalf of a single user
+    'hour': (250, 60 * 60),
+}
+TUMBLR_TIMEOUT = 30  # seconds to wait for Tumblr API response
+TUMBLR_CLIENTS_CACHE_SIZE = 1000  # API clients of different users kept per process
+TUMBLR_RATE_LIMIT_MAX_WAIT = 10  # seconds to wait for a free token before giving up
+TUMBLR_RATE_LIMIT_RETRY_AFTER = 60  # seconds to wait after Tumblr responded with 429
 MIN_POSTS_UPDATE_INTERVAL = 60 * 60 if not DEBUG else 10
+POSTS_FULL_UPDATE_INTERVAL = 24 * 60 * 60  # how often to re-fetch old posts to refresh their note counts
+POSTS_BULK_CHUNK_SIZE = 500
+POSTS_UPDATE_CHUNK_SIZE = 5000  # full updates of bigger blogs are split into jobs of this many posts
+NOTE_GRAPH_MAX_POINTS = 1000
+TAG_PAIRS_MIN_POSTS = 2  # tag pairs met on fewer posts are not stored
+SNAPSHOTS_DOWNSAMPLING = [  # (age, interval) in seconds: older snapshots are thinned to one per interval
+    (30 * 24 * 60 * 60, 24 * 60 * 60),
+    (365 * 24 * 60 * 60, 7 * 24 * 60 * 60),
+]
+POSTS_PAGES_IN_FLIGHT = 8  # pages fetched from Tumblr ahead of saving them
+POSTS_FETCH_CONCURRENCY = 4  # maximum concurrent requests to Tumblr per update
+TUMBLR_FETCH_RETRIES = 3  # retries of a page request failed because of network or Tumblr server error
+TUMBLR_FETCH_BACKOFF = 1  # seconds to wait before the first retry, doubled on every next one
+UPDATE_MAX_RETRIES = 5  # retries of update jobs failed because of temporary errors
+UPDATE_MIN_BACKOFF = 30 * 1000  # milliseconds to wait before the first retry of update job
+UPDATE_MAX_BACKOFF = 30 * 60 * 1000
+UPDATE_TIME_LIMIT = 3 * 60 * 60 * 1000  # milliseconds an update job may run, full updates of big blogs take long
+EXPORT_CHUNK_SIZE = 10000  # rows fetched from database cursor and written to export file at once
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
@@ -110,9 +145,43 @@ REDIS = {
     'db': os.getenv('REDIS_DB'),
 }
 
+REDIS_MAX_CONNECTIONS = 50  # per process, callers wait for a free connection when all are busy
+HTTP_POOL_SIZE = 10  # kept alive connections per host, per process
+
+# Send counts and durations of SQL queries, Redis and Tumblr calls made by requests in response headers
+INSTRUMENTATION_HEADERS = DEBUG or bool(int(os.getenv('INSTRUMENTATION_HEADERS', 0)))
+
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+BLOG_CACHE_TTL = 60  # seconds resolved blogs are kept by process, they are dropped earlier when blog data changes
+USER_INFO_CACHE_TTL = 5 * 60  # seconds user info got from Tumblr is kept by process for the read API
+MEMO_CACHE_SIZE = 10000  # values kept by every process cache
+
+UPDATE_MAX_PUBLIC_BLOGS = 10  # public blogs which can be requested to update at once
+UPDATE_PROGRESS_TTL = 24 * 60 * 60  # how long progress of the latest update is kept
+UPDATE_STATUS_STREAM_TIMEOUT = 5 * 60  # seconds to keep update status stream open, clients reconnect then
+UPDATE_STATUS_STREAM_INTERVAL = 1  # seconds between checks for progress changes in the stream
+UPDATE_USER_CONCURRENCY = 2  # background jobs (other blogs, parts of chunked updates) of a single user run at once
+SCHEDULED_UPDATE_MIN_INTERVAL = 15 * 60
+SCHEDULED_UPDATE_MAX_INTERVAL = 7 * 24 * 60 * 60
+SCHEDULED_UPDATE_ACTIVITY_WINDOW = 30 * 24 * 60 * 60  # posting frequency is measured over this period
+SCHEDULED_UPDATES_PER_TICK = 100
+SCHEDULER_TICK = 60  # seconds between scheduler runs
+SCHEDULER_SYNC_TICKS = 60  # scheduler looks for new users once per this many ticks
+
 DRAMATIQ_BROKER = {
     "BROKER": "dramatiq.brokers.redis.RedisBroker",
     "OPTIONS": REDIS,
+    "MIDDLEWARE": [
+        "dramatiq.middleware.Prometheus",
+        "dramatiq.middleware.AgeLimit",
+        "dramatiq.middleware.TimeLimit",
+        "dramatiq.middleware.Callbacks",
+        "dramatiq.middleware.Retries",
+        "dramatiq.middleware.CurrentMessage",
+        "django_dramatiq.middleware.DbConnectionsMiddleware",
+        "backend.instrumentation.JobInstrumentationMiddleware",
+        "backend.clients.ClientsMiddleware",
+    ],
 }
 
 DRAMATIQ_RESULT_BACKEND = {
@@ -0,0 +1,125 @@
+import asyncio
+from contextvars import ContextVar
+from asgiref.sync import ThreadSensitiveContext, async_to_sync, sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+from backend.clients import close_async_http_client
+
+# Receive callable of the ASGI connection being handled
+_receive = ContextVar('asgi_receive')
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """
+    Streaming response with content produced by an async iterator, so long-lived streams
+    don't hold a thread or block the event loop. Django 3.2 streams only sync iterators,
+    AsyncStreamingASGIHandler is needed to stream it asynchronously.
+    Under WSGI (runserver, test client) the stream runs in a separate event loop
+    """
+    def _set_streaming_content(self, value):
+        if not hasattr(value, '__aiter__'):
+            # Sync iterator wrapping the stream, e.g. set by test client
+            self.is_async = False
+            return super()._set_streaming_content(value)
+        self.is_async = True
+        self._async_iterator = value.__aiter__()
+        if hasattr(value, 'aclose'):
+            async def aclose():
+                await value.aclose()
+            self._resource_closers.append(async_to_sync(aclose))
+
+    @property
+    def streaming_content(self):
+        if not self.is_async:
+            return super().streaming_content
+        return self._iterate()
+
+    @streaming_content.setter
+    def streaming_content(self, value):
+        self._set_streaming_content(value)
+
+    async def async_streaming_content(self):
+        async for part in self._async_iterator:
+            yield self.make_bytes(part)
+
+    def _iterate(self):
+        # Async generator can't be moved between event loops, so the whole stream runs in its own loop
+        loop = asyncio.new_event_loop()
+        stream = self.async_streaming_content()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(stream.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(close_async_http_client())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+
+class AsyncStreamingASGIHandler(ASGIHandler):
+    """
+    ASGI handler which doesn't block the event loop while streaming responses:
+    AsyncStreamingHttpResponse is sent with async iteration, other streaming responses
+    are iterated in the thread of the request.
+    Every request gets its own thread for synchronous code (ORM calls, sync views and middleware),
+    otherwise Django 3.2 runs such code of all requests in a single thread.
+    Streaming is stopped as soon as the client disconnects.
+    Handles lifespan events to close clients of the event loop on server shutdown
+    """
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.handle_lifespan(receive, send)
+        _receive.set(receive)
+        async with ThreadSensitiveContext():
+            await super().__call__(scope, receive, send)
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_async_http_client()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        headers += [(b'Set-Cookie', c.output(header='').encode('ascii').strip()) for c in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        streaming = asyncio.ensure_future(self.send_streaming_content(response, send))
+        disconnect = asyncio.ensure_future(self.wait_disconnect(_receive.get()))
+        await asyncio.wait([streaming, disconnect], return_when=asyncio.FIRST_COMPLETED)
+        for task in (streaming, disconnect):
+            task.cancel()
+        try:
+            await streaming
+        except asyncio.CancelledError:
+            pass  # client has gone, there's no one to send the rest to
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    async def send_streaming_content(response, send):
+        if getattr(response, 'is_async', False):
+            async for part in response.async_streaming_content():
+                await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+        else:
+            # Sync iterators may read database cursors, which are bound to the thread of the request
+            parts = iter(response)
+            next_part = sync_to_async(next, thread_sensitive=True)
+            while True:
+                part = await next_part(parts, None)
+                if part is None:
+                    break
+                await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+        await send({'type': 'http.response.body'})
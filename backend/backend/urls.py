@@ -1,10 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
+from backend.instrumentation import metrics_view
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('oauth/', include('tumblr_auth.urls')),
     path('api/', include('tumblr_posts.urls')),
+    path('metrics', metrics_view),
 ]
 
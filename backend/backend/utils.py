@@ -1,7 +1,10 @@
+import asyncio
 import re
-from functools import wraps
+from functools import update_wrapper, wraps
 
+from asgiref.sync import sync_to_async
 from django.http import HttpResponse
+from django.views import View
 
 
 def shorten_string(string: str, length=100) -> str:
@@ -18,10 +21,52 @@ def shorten_string(string: str, length=100) -> str:
         return string[:length] + '...'
 
 
+class AsyncView(View):
+    """
+    Class based view with coroutine handlers, e.g. `async def get(self, request)`.
+    Django 3.2 runs class based views synchronously, so view function is made a coroutine function here
+    """
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            # Handlers of not allowed methods and OPTIONS are synchronous
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+        update_wrapper(async_view, view)
+        return async_view
+
+
+async def get_request_user(request):
+    """
+    Get user of the request from async code. Session and user are loaded in a thread
+    and cached in the request, so request.user can be used after this without blocking
+
+    :param request: HTTP request
+    :return: User or AnonymousUser
+    """
+    def load():
+        request.user.is_authenticated  # evaluate lazy object
+        return request.user
+    return await sync_to_async(load)()
+
+
 def login_required(func):
     """
     Decorator for views to check authorization. Will return 401 error if user is not authenticated
     """
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(self, request, *args, **kwargs):
+            user = await get_request_user(request)
+            if not user.is_authenticated:
+                return HttpResponse("You must be logged in", status=401)
+            return await func(self, request, *args, **kwargs)
+        return async_wrapper
+
     @wraps(func)
     def wrapper(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
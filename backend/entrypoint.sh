@@ -28,6 +28,13 @@ wait_for_db() {
 done
 }
 
+# Processes started after this share Prometheus metrics through files in the directory
+prepare_metrics_dir() {
+    export prometheus_multiproc_dir="$1"
+    rm -rf "$prometheus_multiproc_dir"
+    mkdir -p "$prometheus_multiproc_dir"
+}
+
 
 if [ "$1" == "server" ]; then
     wait_for_db
@@ -35,7 +42,8 @@ if [ "$1" == "server" ]; then
     python3 manage.py migrate
     echo "Running collectstatic"
     python3 manage.py collectstatic --noinput
-    exec gunicorn backend.wsgi -w 4 --worker-class gevent -b 0.0.0.0:8000 --chdir=/app
+    prepare_metrics_dir /tmp/prometheus
+    exec gunicorn backend.asgi:application -w 4 --worker-class uvicorn.workers.UvicornWorker -b 0.0.0.0:8000 --chdir=/app
 fi
 
 if [ "$1" == "debug_server" ]; then
@@ -52,7 +60,8 @@ if [ "$1" == "nomigrate" ]; then
     wait_for_db
     echo "Running collectstatic"
     python3 manage.py collectstatic --noinput
-    exec gunicorn backend.wsgi -w 4 --worker-class gevent -b 0.0.0.0:8000 --chdir=/app
+    prepare_metrics_dir /tmp/prometheus
+    exec gunicorn backend.asgi:application -w 4 --worker-class uvicorn.workers.UvicornWorker -b 0.0.0.0:8000 --chdir=/app
 fi
 
 if [ "$1" == "migrate" ]; then
@@ -68,8 +77,20 @@ fi
 
 if [ "$1" == "dramatiq_worker" ]; then
     wait_for_db
+    prepare_metrics_dir /tmp/dramatiq-prometheus
     exec python3 manage.py rundramatiq
 fi
 
+if [ "$1" == "dramatiq_interactive_worker" ]; then
+    wait_for_db
+    prepare_metrics_dir /tmp/dramatiq-prometheus
+    exec python3 manage.py rundramatiq --queues interactive
+fi
+
+if [ "$1" == "scheduler" ]; then
+    wait_for_db
+    exec python3 manage.py schedule_updates
+fi
+
 echo "No action was specified"
 exit 1
\ No newline at end of file
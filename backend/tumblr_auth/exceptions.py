@@ -1,2 +1,11 @@
 class UnauthorizedError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class RateLimitExceeded(Exception):
+    """
+    Tumblr API quota is exhausted. `retry_after` is count of seconds after which the call may succeed
+    """
+    def __init__(self, retry_after: float):
+        super().__init__(f'Tumblr API rate limit exceeded, retry after {retry_after:.0f} seconds')
+        self.retry_after = retry_after
\ No newline at end of file
@@ -0,0 +1,73 @@
+from typing import Optional, Tuple
+import httpx
+from django.conf import settings
+from oauthlib import oauth1
+from backend.clients import get_async_http_client
+from backend.instrumentation import measure
+from tumblr_auth.exceptions import RateLimitExceeded
+from tumblr_auth.services.ratelimit import TumblrRateLimiter
+
+
+def parse_qs(query_string):
+    result = {}
+    for pair in query_string.split('&'):
+        key, value = pair.split('=')
+        result[key] = value
+    return result
+
+
+class AsyncTumblrClient:
+    """
+    Asynchronous Tumblr client for calls made by views under ASGI, so waiting for Tumblr
+    doesn't hold a thread. Implements only OAuth flow and calls needed by views.
+    API calls are rate limited and measured the same way as calls of RateLimitedClient
+    """
+    def __init__(self, token: Optional[str] = None, secret: Optional[str] = None, verifier: Optional[str] = None):
+        self.identity = token
+        self.oauth = oauth1.Client(
+            settings.TUMBLR_CONSUMER_KEY,
+            client_secret=settings.TUMBLR_CONSUMER_SECRET,
+            resource_owner_key=token,
+            resource_owner_secret=secret,
+            verifier=verifier,
+        )
+        self.limiter = TumblrRateLimiter()
+
+    async def _send(self, method: str, url: str) -> httpx.Response:
+        url, headers, _ = self.oauth.sign(url, http_method=method)
+        return await get_async_http_client().request(method, url, headers=headers, timeout=settings.TUMBLR_TIMEOUT)
+
+    async def fetch_token(self, url: str) -> Optional[Tuple[str, str]]:
+        """
+        Get OAuth request token or access token, depending on URL
+
+        :param url: TUMBLR_REQUEST_TOKEN_URL or TUMBLR_ACCESS_TOKEN_URL
+        :return: token and secret, None if Tumblr refused to issue them
+        """
+        response = await self._send('POST', url)
+        if response.status_code != 200:
+            return None
+        payload = parse_qs(response.text)
+        return payload['oauth_token'], payload['oauth_token_secret']
+
+    async def _call(self, name: str, path: str) -> dict:
+        await self.limiter.acquire_async(self.identity)
+        with measure('tumblr', name):
+            response = await self._send('GET', settings.TUMBLR_API_HOST + path)
+        try:
+            data = response.json()
+        except ValueError:
+            data = {'meta': {'status': 500, 'msg': 'Server Error'}}
+        status = data['meta']['status']
+        if status == 429:
+            raise RateLimitExceeded(settings.TUMBLR_RATE_LIMIT_RETRY_AFTER)
+        # Same as pytumblr: response on success, the whole payload with error otherwise
+        return data['response'] if 200 <= status <= 399 else data
+
+    async def info(self) -> dict:
+        """
+        Get information about the authorized user
+
+        :return: user info
+        """
+        return await self._call('info', '/v2/user/info')
@@ -1,22 +1,24 @@
+import threading
+import urllib.parse
+from collections import OrderedDict
 from typing import Optional
 import pytumblr
-import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model, login
-from requests_oauthlib import OAuth1
+from pytumblr.request import TumblrRequest
+from requests.exceptions import TooManyRedirects
+from backend.cache import ResponseCache
+from backend.clients import get_http_session
+from backend.memo import TTLCache, get_scoped, set_scoped
 from tumblr_auth.models import TumblrCredentials
 from tumblr_auth.exceptions import UnauthorizedError
+from tumblr_auth.services.async_client import AsyncTumblrClient
+from tumblr_auth.services.ratelimit import TumblrRateLimiter, RateLimitedClient
 
 
 user_model = get_user_model()
-
-
-def parse_qs(query_string):
-    result = {}
-    for pair in query_string.split('&'):
-        key, value = pair.split('=')
-        result[key] = value
-    return result
+_user_infos = TTLCache()  # user id: (data version of primary blog, user info)
 
 
 def _parse_avatar(avatars_info, resolution):
@@ -38,6 +40,67 @@ def _parse_blog_info(blog):
     }
 
 
+def _parse_user_info(info):
+    return {
+        'name': info['name'],
+        'likes': info['likes'],
+        'following': info['following'],
+        'blogs': [_parse_blog_info(blog) for blog in info['blogs']],
+    }
+
+
+class PooledTumblrRequest(TumblrRequest):
+    """
+    pytumblr request object sending GET requests through the process-wide HTTP session,
+    so connections to Tumblr are kept alive instead of being opened for every call
+    """
+    def get(self, url, params):
+        url = self.host + url
+        if params:
+            url = url + "?" + urllib.parse.urlencode(params)
+        try:
+            resp = get_http_session().get(url, allow_redirects=False, headers=self.headers, auth=self.oauth,
+                                          timeout=settings.TUMBLR_TIMEOUT)
+        except TooManyRedirects as e:
+            resp = e.response
+        return self.json_parse(resp)
+
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def _get_cached_client(token: Optional[str] = None, secret: Optional[str] = None) -> RateLimitedClient:
+    """
+    Get rate limited client for the OAuth identity (or for API key if token is None).
+    Clients are kept per process, least recently used ones are dropped above TUMBLR_CLIENTS_CACHE_SIZE
+
+    :param token: user's personal API token
+    :param secret: user's personal API secret key
+    :return: rate limited pytubmlr client instance
+    """
+    key = (settings.TUMBLR_API_HOST, token, secret)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+    tumblr_client = pytumblr.TumblrRestClient(settings.TUMBLR_CONSUMER_KEY, host=settings.TUMBLR_API_HOST)
+    tumblr_client.request = PooledTumblrRequest(
+        settings.TUMBLR_CONSUMER_KEY,
+        consumer_secret=settings.TUMBLR_CONSUMER_SECRET if token is not None else '',
+        oauth_token=token or '',
+        oauth_secret=secret or '',
+        host=settings.TUMBLR_API_HOST,
+    )
+    client = RateLimitedClient(tumblr_client, TumblrRateLimiter(), identity=token)
+    with _clients_lock:
+        _clients[key] = client
+        while len(_clients) > settings.TUMBLR_CLIENTS_CACHE_SIZE:
+            _clients.popitem(last=False)
+    return client
+
+
 class AuthService:
     """
     Tumblr authentication service.
@@ -47,20 +110,27 @@ class AuthService:
         self.user_model = get_user_model()
 
     @staticmethod
-    def get_tumblr_client(token: str, secret: str) -> pytumblr.TumblrRestClient:
+    def get_tumblr_client(token: str, secret: str) -> RateLimitedClient:
         """
-        Get pytumblr client for executing API calls on behalf of authorized user
+        Get pytumblr client for executing API calls on behalf of authorized user.
+        Calls made with this client are subject to the shared rate limits.
+        Clients are reused within the process
 
         :param token: user's personal API token
         :param secret: user's personal API secret key
-        :return: pytubmlr client instance
+        :return: rate limited pytubmlr client instance
         """
-        return pytumblr.TumblrRestClient(
-            consumer_key=settings.TUMBLR_CONSUMER_KEY,
-            consumer_secret=settings.TUMBLR_CONSUMER_SECRET,
-            oauth_token=token,
-            oauth_secret=secret,
-        )
+        return _get_cached_client(token, secret)
+
+    @staticmethod
+    def get_api_client() -> RateLimitedClient:
+        """
+        Get pytumblr client for executing public API calls with application's API key.
+        The client is reused within the process
+
+        :return: rate limited pytubmlr client instance
+        """
+        return _get_cached_client()
 
     @staticmethod
     def get_session_key(request) -> str:
@@ -74,23 +144,24 @@ class AuthService:
             request.session.save()
         return request.session.session_key
 
-    def get_login_uri(self, request) -> str:
+    async def get_login_uri(self, request) -> Optional[str]:
         """
         Generate login URL (URL to which user should be redirected for authorization in Tumblr)
 
         :param request: HTTP request passed from View
-        :return: URL
+        :return: URL, None if Tumblr refused to issue request token
         """
-        oauth = OAuth1(client_key=settings.TUMBLR_CONSUMER_KEY, client_secret=settings.TUMBLR_CONSUMER_SECRET)
-        response = requests.post(settings.TUMBLR_REQUEST_TOKEN_URL, auth=oauth)
-        payload = parse_qs(response.text)
-        token = payload['oauth_token']
-        secret = payload['oauth_token_secret']
-        request.session['tumblr_request_token'] = token
-        request.session['tumblr_request_secret'] = secret
+        credentials = await AsyncTumblrClient().fetch_token(settings.TUMBLR_REQUEST_TOKEN_URL)
+        if credentials is None:
+            return None
+        token, secret = credentials
+        await sync_to_async(request.session.update)({
+            'tumblr_request_token': token,
+            'tumblr_request_secret': secret,
+        })
         return settings.TUMBLR_AUTHORIZATION_URL + '?oauth_token=' + token
 
-    def login_user(self, request, token, secret, verifier) -> Optional[dict]:
+    async def login_user(self, request, token, secret, verifier) -> Optional[dict]:
         """
         Log user in. Will set a cookie to request to make user authenticated if successful.
 
@@ -98,31 +169,28 @@ class AuthService:
         :param token: user's personal token
         :param secret: user's personal secret key
         :param verifier: user's verifier string
-        :return: user info if logged in successfully, otherwise None
+        :return: user info with `created` flag if logged in successfully, otherwise None
         """
-
-        oauth = OAuth1(client_key=settings.TUMBLR_CONSUMER_KEY, client_secret=settings.TUMBLR_CONSUMER_SECRET,
-                       resource_owner_key=token, resource_owner_secret=secret, verifier=verifier)
-        r = requests.post(settings.TUMBLR_ACCESS_TOKEN_URL, auth=oauth)
-        if r.status_code == 200:
-            payload = parse_qs(r.text)
-            access_token = payload['oauth_token']
-            access_token_secret = payload['oauth_token_secret']
-            client = self.get_tumblr_client(access_token, access_token_secret)
-            info = client.info()
-            if info is not None:
-                user, created = self.user_model.objects.get_or_create(username=info['user']['name'])
-                TumblrCredentials.objects.update_or_create(
-                    user=user,
-                    defaults={
-                        'token': access_token,
-                        'secret': access_token_secret,
-                    }
-                )
-                info['created'] = created
-                login(request, user)
+        credentials = await AsyncTumblrClient(token, secret, verifier).fetch_token(settings.TUMBLR_ACCESS_TOKEN_URL)
+        if credentials is not None:
+            access_token, access_token_secret = credentials
+            payload = await AsyncTumblrClient(access_token, access_token_secret).info()
+            info = _parse_user_info(payload['user'])
+            info['created'] = await sync_to_async(self._save_user)(request, info['name'], *credentials)
             return info
 
+    def _save_user(self, request, username: str, access_token: str, access_token_secret: str) -> bool:
+        user, created = self.user_model.objects.get_or_create(username=username)
+        TumblrCredentials.objects.update_or_create(
+            user=user,
+            defaults={
+                'token': access_token,
+                'secret': access_token_secret,
+            }
+        )
+        login(request, user)
+        return created
+
     def get_user_info(self, user: user_model) -> Optional[dict]:
         """
         Try to get basic user information if user is authenticated in Tumblr
@@ -136,11 +204,32 @@ class AuthService:
         except TumblrCredentials.DoesNotExist:
             raise UnauthorizedError()
         client = self.get_tumblr_client(token, secret)
-        info = client.info()['user']
-        result = {
-            'name': info['name'],
-            'likes': info['likes'],
-            'following': info['following'],
-            'blogs': [_parse_blog_info(blog) for blog in info['blogs']],
-        }
-        return result
+        return _parse_user_info(client.info()['user'])
+
+    async def get_user_info_async(self, user: user_model) -> Optional[dict]:
+        """
+        Same as get_user_info, but doesn't block while waiting for Tumblr.
+        Info is memoized for the request and for USER_INFO_CACHE_TTL by the process,
+        until blogs info of the user is updated
+
+        :param user: User object
+        :return: User info
+        :raises: UnauthorizedError
+        """
+        info = get_scoped(('user_info', user.pk))
+        if info is not None:
+            return info
+        version = await sync_to_async(ResponseCache().get_version, thread_sensitive=False)(user.username)
+        cached = _user_infos.get(user.pk)
+        if cached is not None and cached[0] == version:
+            info = cached[1]
+        else:
+            try:
+                credentials = await sync_to_async(lambda: user.tumblrcredentials)()
+            except TumblrCredentials.DoesNotExist:
+                raise UnauthorizedError()
+            payload = await AsyncTumblrClient(credentials.token, credentials.secret).info()
+            info = _parse_user_info(payload['user'])
+            _user_infos.set(user.pk, (version, info), settings.USER_INFO_CACHE_TTL)
+        set_scoped(('user_info', user.pk), info)
+        return info
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import time
+from functools import wraps
+from typing import List, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from backend.clients import get_redis
+from backend.instrumentation import measure
+from tumblr_auth.exceptions import RateLimitExceeded
+
+
+# Checks all buckets passed in KEYS and takes a token from each of them only if every bucket has one.
+# ARGV: current time, then (capacity, period) for every key.
+# Returns '0' if tokens were taken, otherwise count of seconds to wait until they are available
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = capacity / tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    available = math.min(capacity, available + math.max(0, now - ts) * rate)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tostring(tokens[i] - 1), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[i * 2 + 1])))
+end
+return '0'
+"""
+
+
+class TumblrRateLimiter:
+    """
+    Token bucket rate limiter for Tumblr API calls shared by all web and worker processes through Redis.
+    Every call takes a token from each of the consumer key buckets (TUMBLR_RATE_LIMITS) and,
+    for calls on behalf of a user, from each of the user's buckets (TUMBLR_USER_RATE_LIMITS)
+    """
+    def __init__(self):
+        self.redis = get_redis()
+        self.script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.max_wait = settings.TUMBLR_RATE_LIMIT_MAX_WAIT
+        self.key = 'tumblr-rate-{}'
+
+    def _get_buckets(self, identity: Optional[str] = None) -> List[Tuple[str, int, int]]:
+        """
+        Get buckets which should be checked for a call
+
+        :param identity: OAuth token of the user on behalf of whom the call is made, None for API key calls
+        :return: list of (key, capacity, period in seconds)
+        """
+        buckets = [
+            (self.key.format(name), limit, period)
+            for name, (limit, period) in settings.TUMBLR_RATE_LIMITS.items()
+        ]
+        if identity is not None:
+            # Tokens are secret, so they aren't put into key names, which are visible to anyone with access to Redis
+            user = hashlib.sha256(identity.encode()).hexdigest()[:32]
+            buckets += [
+                (self.key.format(f'{name}-{user}'), limit, period)
+                for name, (limit, period) in settings.TUMBLR_USER_RATE_LIMITS.items()
+            ]
+        return buckets
+
+    def try_acquire(self, identity: Optional[str] = None) -> float:
+        """
+        Try to take a token for one API call
+
+        :param identity: OAuth token of the user on behalf of whom the call is made
+        :return: 0 if the call is allowed, otherwise seconds to wait before trying again
+        """
+        buckets = self._get_buckets(identity)
+        args = [time.time()]
+        for key, limit, period in buckets:
+            args += [limit, period]
+        return float(self.script(keys=[key for key, limit, period in buckets], args=args))
+
+    def acquire(self, identity: Optional[str] = None, max_wait: Optional[float] = None) -> None:
+        """
+        Wait until API call is allowed
+
+        :param identity: OAuth token of the user on behalf of whom the call is made
+        :param max_wait: maximum seconds to wait, defaults to TUMBLR_RATE_LIMIT_MAX_WAIT
+        :raises: RateLimitExceeded if the call isn't allowed within max_wait
+        """
+        if max_wait is None:
+            max_wait = self.max_wait
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(identity)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, identity: Optional[str] = None, max_wait: Optional[float] = None) -> None:
+        """
+        Wait until API call is allowed without blocking the event loop
+
+        :param identity: OAuth token of the user on behalf of whom the call is made
+        :param max_wait: maximum seconds to wait, defaults to TUMBLR_RATE_LIMIT_MAX_WAIT
+        :raises: RateLimitExceeded if the call isn't allowed within max_wait
+        """
+        if max_wait is None:
+            max_wait = self.max_wait
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = await sync_to_async(self.try_acquire, thread_sensitive=False)(identity)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(wait)
+            await asyncio.sleep(wait)
+
+
+class RateLimitedClient:
+    """
+    Proxy for pytumblr client which takes a token from rate limiter before every API call,
+    measures the call and turns 429 responses into RateLimitExceeded
+    """
+    def __init__(self, client, limiter: TumblrRateLimiter, identity: Optional[str] = None):
+        self.client = client
+        self.limiter = limiter
+        self.identity = identity
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def wrapper(*args, **kwargs):
+            self.limiter.acquire(self.identity)
+            with measure('tumblr', name):
+                response = attr(*args, **kwargs)
+            if isinstance(response, dict) and response.get('meta', {}).get('status') == 429:
+                raise RateLimitExceeded(settings.TUMBLR_RATE_LIMIT_RETRY_AFTER)
+            return response
+        return wrapper
@@ -1,18 +1,25 @@
 import json
-from backend.utils import login_required
-from tumblr_posts.tasks import update_posts_and_blog_info
+from asgiref.sync import sync_to_async
+from backend.cache import cache_json_response
+from backend.utils import AsyncView, get_request_user, login_required
+from tumblr_posts.services.progress import ProgressService
+from tumblr_posts.services.tumblr import BlogsService
+from tumblr_posts.tasks import enqueue_update, first_update
 from django.views import View
 from tumblr_auth.services.auth import AuthService
+from tumblr_auth.exceptions import RateLimitExceeded
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import logout
 from django.http import HttpResponseRedirect, HttpResponse
 
 
-class LoginView(View):
-    def get(self, request):
-        if isinstance(request.user, AnonymousUser):
+class LoginView(AsyncView):
+    async def get(self, request):
+        if isinstance(await get_request_user(request), AnonymousUser):
             auth_service = AuthService()
-            uri = auth_service.get_login_uri(request)
+            uri = await auth_service.get_login_uri(request)
+            if uri is None:
+                return HttpResponse('Tumblr is unavailable, try again later', status=503)
             return HttpResponseRedirect(uri)
         else:
             return HttpResponseRedirect('/')
@@ -24,20 +31,33 @@ class LogoutView(View):
         return HttpResponseRedirect('/')
 
 
-class CallbackView(View):
-    def get(self, request):
+class CallbackView(AsyncView):
+    async def get(self, request):
         auth_service = AuthService()
-        token = request.session.get('tumblr_request_token')
+        token = await sync_to_async(request.session.get)('tumblr_request_token')
         secret = request.session.get('tumblr_request_secret')
         verifier = request.GET.get('oauth_verifier')
-        info = auth_service.login_user(request, token, secret, verifier)
-        if info and info.get('created', False):
-            update_posts_and_blog_info.send(request.user.id)
+        info = await auth_service.login_user(request, token, secret, verifier)
+        if info is not None:
+            await sync_to_async(self._on_login)(request.user, info)
         return HttpResponseRedirect('/')
 
+    @staticmethod
+    def _on_login(user, info):
+        # Blogs are saved right away, so read API knows them before the first update is finished
+        BlogsService().save_user_info(user, info)
+        if info['created'] and enqueue_update(first_update, user.id):
+            ProgressService().queue(user.username)
 
-class UserInfoView(View):
+
+class UserInfoView(AsyncView):
     @login_required
-    def get(self, request):
-        info = AuthService().get_user_info(request.user)
+    @cache_json_response
+    async def get(self, request):
+        try:
+            info = await AuthService().get_user_info_async(request.user)
+        except RateLimitExceeded as e:
+            response = HttpResponse("Tumblr API rate limit exceeded", status=429)
+            response['Retry-After'] = int(e.retry_after) + 1
+            return response
         return HttpResponse(json.dumps(info, ensure_ascii=False), content_type="application/json")
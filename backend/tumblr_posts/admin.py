@@ -8,7 +8,15 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('is_reblog', 'mobile', 'blog', 'tags')
     sortable_by = ('note_count', 'date', 'timestamp')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('tags')
+
 
 @admin.register(models.Blog)
 class BlogAdmin(admin.ModelAdmin):
     list_display = ('blog_name', 'title', 'user', 'followers', 'posts', 'updated')
+
+
+@admin.register(models.BlogStats)
+class BlogStatsAdmin(admin.ModelAdmin):
+    list_display = ('blog', 'updated')
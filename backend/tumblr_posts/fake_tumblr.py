@@ -0,0 +1,160 @@
+import json
+import multiprocessing
+import re
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+import requests
+
+START_TIMESTAMP = 1262304000  # 2010-01-01
+
+
+class FakeBlog:
+    """
+    Synthetic blog with posts generated on the fly from their offsets, so blogs
+    of any size take no memory. Posts are returned newest first, as Tumblr does
+    """
+    def __init__(self, name: str, posts: int, tags: int = 1000, tags_per_post: int = 3, interval: int = 60 * 60):
+        self.name = name
+        self.posts = posts
+        self.tags = tags
+        self.tags_per_post = tags_per_post
+        self.interval = interval
+
+    def get_post(self, offset: int) -> dict:
+        post_id = self.posts - offset
+        timestamp = START_TIMESTAMP + post_id * self.interval
+        post = {
+            'id': post_id,
+            'blog_name': self.name,
+            'post_url': f'https://{self.name}.tumblr.com/post/{post_id}/post-{post_id}',
+            'date': '2010-01-01 00:00:00 GMT',
+            'timestamp': timestamp,
+            'summary': f'Post {post_id}',
+            'slug': f'post-{post_id}',
+            'title': f'Post {post_id}' if post_id % 3 else None,
+            'note_count': (post_id * 7919) % 1000,
+            'tags': [f'tag-{(post_id * 31 + i * 97) % self.tags}' for i in range(min(self.tags_per_post, self.tags))],
+        }
+        if post_id % 5 == 0:
+            post['reblogged_from_id'] = post_id + 1
+        return post
+
+    def get_posts(self, offset: int, limit: int) -> list:
+        return [self.get_post(o) for o in range(offset, min(offset + limit, self.posts))]
+
+    def get_info(self) -> dict:
+        return {
+            'name': self.name,
+            'uuid': f't:{self.name}',
+            'title': self.name.capitalize(),
+            'avatar': [{'width': 128, 'height': 128, 'url': f'https://{self.name}.tumblr.com/avatar'}],
+            'primary': True,
+            'posts': self.posts,
+            'followers': 0,
+        }
+
+
+class FakeTumblrServer:
+    """
+    Local stand-in for Tumblr API serving user info and posts of synthetic blogs.
+    The server runs in a separate process, so it doesn't affect time and memory measured
+    in the application process. Point TUMBLR_API_HOST setting to `url` to make the application use it.
+    The first blog is returned as the primary blog of authorized user
+    """
+    BLOG_URL = re.compile(r'^/v2/blog/([^/]+)/(posts|info)$')
+
+    def __init__(self, blogs: List[FakeBlog], host: str = '127.0.0.1'):
+        self.blogs = {blog.name: blog for blog in blogs}
+        self.user_blog = blogs[0]
+        self.host = host
+        self.port = None
+        self.process = None
+        self.calls = Counter()
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def start(self) -> None:
+        ports = multiprocessing.Queue()
+        process = multiprocessing.Process(target=self._serve, args=(ports,), daemon=True)
+        process.start()
+        self.process = process
+        self.port = ports.get(timeout=10)
+
+    def stop(self) -> None:
+        self.process.terminate()
+        self.process.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def pop_calls(self) -> Dict[str, int]:
+        """
+        Get counts of requests served per endpoint since the previous call
+
+        :return: endpoint: count of requests
+        """
+        response = requests.get(f'{self.url}/_calls')
+        return response.json()
+
+    def _serve(self, ports) -> None:
+        server = ThreadingHTTPServer((self.host, 0), self._make_handler())
+        server.daemon_threads = True
+        ports.put(server.server_address[1])
+        server.serve_forever()
+
+    def _respond(self, path: str, query: dict) -> tuple:
+        if path == '/_calls':
+            calls = dict(self.calls)
+            self.calls.clear()
+            return 200, calls
+        if path == '/v2/user/info':
+            self.calls['user/info'] += 1
+            blog = self.user_blog
+            return 200, {'user': {'name': blog.name, 'likes': 0, 'following': 0, 'blogs': [blog.get_info()]}}
+        match = self.BLOG_URL.match(path)
+        if match is None:
+            return 404, {}
+        name, endpoint = match.group(1).replace('.tumblr.com', ''), match.group(2)
+        self.calls[endpoint] += 1
+        if name not in self.blogs:
+            return 404, {}
+        blog = self.blogs[name]
+        if endpoint == 'info':
+            return 200, {'blog': blog.get_info()}
+        offset = int(query.get('offset', ['0'])[0])
+        limit = min(int(query.get('limit', ['20'])[0]), 50)
+        return 200, {'blog': blog.get_info(), 'posts': blog.get_posts(offset, limit), 'total_posts': blog.posts}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/_calls':
+                    status, response = fake._respond(url.path, {})
+                    body = json.dumps(response).encode()
+                else:
+                    status, response = fake._respond(url.path, parse_qs(url.query))
+                    body = json.dumps({'meta': {'status': status, 'msg': 'OK' if status == 200 else 'Not Found'},
+                                       'response': response}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
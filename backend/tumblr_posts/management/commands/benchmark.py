@@ -0,0 +1,157 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from tumblr_auth.models import TumblrCredentials
+from tumblr_posts.fake_tumblr import FakeBlog, FakeTumblrServer
+from tumblr_posts.services.tumblr import BlogsService, PostsService
+
+READ_ENDPOINTS = [
+    '/api/top/',
+    '/api/top/?count=50',
+    '/api/note_graph/',
+    '/api/note_graph/?points=100',
+    '/api/stats/?period=month',
+    '/api/tags/',
+    '/api/growth/',
+]
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting executed queries
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark posts ingest and read API endpoints against a local fake Tumblr API and print '
+            'results as JSON. Runs on a separate test database, but uses configured Redis, '
+            'so REDIS_DB should point to a scratch database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, nargs='+', default=[1000, 10000],
+                            help='Sizes of synthetic blogs to benchmark')
+        parser.add_argument('--tags', type=int, default=1000, help='Count of distinct tags in a blog')
+        parser.add_argument('--tags-per-post', type=int, default=3)
+        parser.add_argument('--repeats', type=int, default=20, help='Requests to each read endpoint')
+        parser.add_argument('--output', help='File to write results to instead of stdout')
+        parser.add_argument('--no-memory', action='store_true',
+                            help="Don't trace memory allocations, they slow the code down noticeably")
+        parser.add_argument('--keepdb', action='store_true', help='Preserve the test database between runs')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        databases = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = [self._benchmark_blog(size, options) for size in options['posts']]
+        finally:
+            teardown_databases(databases, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        report = {
+            'time': int(time.time()),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'results': results,
+        }
+        payload = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(payload)
+        else:
+            self.stdout.write(payload)
+
+    def _benchmark_blog(self, size: int, options: dict) -> dict:
+        blog = FakeBlog(f'bench{size}', size, options['tags'], options['tags_per_post'])
+        user = get_user_model().objects.create(username=blog.name)
+        TumblrCredentials.objects.create(user=user, token='token', secret='secret')
+        with FakeTumblrServer([blog]) as server, \
+                override_settings(TUMBLR_API_HOST=server.url, TUMBLR_RATE_LIMITS={}, TUMBLR_USER_RATE_LIMITS={}):
+            BlogsService().update_user_info(user)
+            server.pop_calls()
+            result = {
+                'posts': size,
+                'tags': options['tags'],
+                'tags_per_post': options['tags_per_post'],
+                'full_update': self._measure(server, lambda: PostsService().update_posts(user, full=True),
+                                             not options['no_memory']),
+                # Full update of the blog which posts haven't changed since the previous one
+                'full_refresh': self._measure(server, lambda: PostsService().update_posts(user, full=True),
+                                              not options['no_memory']),
+                'incremental_update': self._measure(server, lambda: PostsService().update_posts(user, full=False),
+                                                    not options['no_memory']),
+                'reads': self._measure_reads(user, options['repeats']),
+            }
+        self.stderr.write(f'{size} posts: full update took {result["full_update"]["seconds"]} s')
+        return result
+
+    def _measure(self, server: FakeTumblrServer, func, trace_memory: bool = True) -> dict:
+        """
+        Measure time, database queries, peak memory allocated by Python and Tumblr API calls of the function
+
+        :param server: fake Tumblr API
+        :param func: function to measure
+        :param trace_memory: measure peak memory, otherwise it's reported as None
+        :return: measurements
+        """
+        counter = QueryCounter()
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            func()
+        seconds = time.perf_counter() - started
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return {
+            'seconds': round(seconds, 3),
+            'queries': counter.count,
+            'peak_memory': peak,
+            'api_calls': server.pop_calls(),
+        }
+
+    def _measure_reads(self, user, repeats: int) -> dict:
+        """
+        Measure latency of read API endpoints. The first request is made with empty response cache
+
+        :param user: User object
+        :param repeats: count of requests to each endpoint
+        :return: endpoint: latencies in milliseconds
+        """
+        client = Client()
+        client.force_login(user)
+        results = {}
+        for path in READ_ENDPOINTS:
+            latencies = []
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                for _ in range(max(repeats, 1)):
+                    started = time.perf_counter()
+                    response = client.get(path)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        raise RuntimeError(f'{path} responded with {response.status_code}')
+            results[path] = {
+                'first_ms': round(latencies[0], 2),
+                'median_ms': round(statistics.median(latencies), 2),
+                'max_ms': round(max(latencies), 2),
+                'queries': counter.count,
+            }
+        return results
@@ -0,0 +1,30 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from tumblr_posts.models import Blog
+from tumblr_posts.services.export import ExportService
+
+
+class Command(BaseCommand):
+    help = 'Export posts, tags or note count history of a blog as CSV, Parquet or Arrow IPC stream'
+
+    def add_arguments(self, parser):
+        parser.add_argument('blog_name')
+        parser.add_argument('--dataset', choices=list(ExportService.DATASETS), default='posts')
+        parser.add_argument('--format', choices=ExportService.FORMATS, default='csv')
+        parser.add_argument('--output', help='File to write to instead of stdout')
+
+    def handle(self, *args, **options):
+        if not ExportService.is_available(options['format']):
+            raise CommandError(f'pyarrow is required to export to {options["format"]}')
+        blog = Blog.objects.filter(blog_name=options['blog_name']).first()
+        if blog is None:
+            raise CommandError(f'Blog {options["blog_name"]} not found')
+        parts = ExportService().export(blog, options['dataset'], options['format'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for part in parts:
+                    f.write(part)
+        else:
+            for part in parts:
+                sys.stdout.buffer.write(part)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from tumblr_posts.models import Blog
+from tumblr_posts.services.dump import DumpReader
+from tumblr_posts.services.tumblr import PostsService
+
+
+class Command(BaseCommand):
+    help = ('Import posts of a blog from a dump of Tumblr API `/posts` responses, either JSON or JSON lines '
+            '(.jsonl, .ndjson). The blog should be known already, e.g. its owner should have logged in')
+
+    def add_arguments(self, parser):
+        parser.add_argument('blog_name')
+        parser.add_argument('path', help='Path to the dump')
+        parser.add_argument('--processes', type=int, help='Processes parsing JSON lines, CPU count by default')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Lines parsed by a process at once')
+
+    def handle(self, *args, **options):
+        blog = Blog.objects.filter(blog_name=options['blog_name']).first()
+        if blog is None:
+            raise CommandError(f'Blog {options["blog_name"]} not found')
+        # Parsing processes are forked, they shouldn't share database connections
+        connections.close_all()
+        reader = DumpReader(options['path'], blog.blog_name, options['processes'], options['batch_size'])
+        started = time.perf_counter()
+        try:
+            count = PostsService().import_posts(blog, reader.read())
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Failed to read {options["path"]}: {e}')
+        self.stdout.write(f'Imported {count} posts in {time.perf_counter() - started:.1f} s')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from tumblr_posts.services.snapshots import SnapshotService
+
+
+class Command(BaseCommand):
+    help = 'Downsample old note count snapshots according to SNAPSHOTS_DOWNSAMPLING setting'
+
+    def handle(self, *args, **options):
+        deleted = SnapshotService().prune()
+        self.stdout.write(f'Deleted {deleted} snapshots')
@@ -0,0 +1,26 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tumblr_posts.services.scheduler import SchedulerService
+from tumblr_posts.tasks import enqueue_scheduled_update
+
+
+class Command(BaseCommand):
+    help = 'Run scheduler which periodically enqueues updates of all blogs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Enqueue due updates once and exit')
+
+    def handle(self, *args, **options):
+        service = SchedulerService()
+        tick = 0
+        while True:
+            if tick % settings.SCHEDULER_SYNC_TICKS == 0:
+                service.sync()
+            enqueued = [blog for blog in service.pop_due() if enqueue_scheduled_update(blog)]
+            if enqueued:
+                self.stdout.write(f'Enqueued updates for {len(enqueued)} blogs')
+            if options['once']:
+                return
+            tick += 1
+            time.sleep(settings.SCHEDULER_TICK)
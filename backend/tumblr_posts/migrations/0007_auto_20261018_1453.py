@@ -0,0 +1,28 @@
+# Generated by Django 3.0.5 on 2026-10-18 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tumblr_posts', '0006_auto_20200519_1842'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='last_full_update',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='last_post_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='last_post_timestamp',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.5 on 2026-10-18 14:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tumblr_posts', '0007_auto_20261018_1453'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlogStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('top_posts', models.TextField(default='[]')),
+                ('top_posts_with_reblogs', models.TextField(default='[]')),
+                ('notes', models.TextField(default='[]')),
+                ('notes_with_reblogs', models.TextField(default='[]')),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('blog', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='tumblr_posts.Blog')),
+            ],
+        ),
+    ]
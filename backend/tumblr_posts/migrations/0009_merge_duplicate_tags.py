@@ -0,0 +1,28 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """
+    Tag names are going to be unique, so posts are moved from duplicates to the oldest tag with the same name
+    """
+    Tag = apps.get_model('tumblr_posts', 'Tag')
+    PostTags = apps.get_model('tumblr_posts', 'Post').tags.through
+    duplicates = Tag.objects.values('name').annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        others = Tag.objects.filter(name=duplicate['name']).exclude(id=duplicate['keep'])
+        for tag in others:
+            tagged = PostTags.objects.filter(tag_id=duplicate['keep']).values('post_id')
+            PostTags.objects.filter(tag_id=tag.id).exclude(post_id__in=tagged).update(tag_id=duplicate['keep'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tumblr_posts', '0008_blogstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+    ]
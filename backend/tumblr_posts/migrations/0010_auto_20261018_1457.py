@@ -0,0 +1,31 @@
+# Generated by Django 3.0.5 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tumblr_posts', '0009_merge_duplicate_tags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blog',
+            name='blog_name',
+            field=models.CharField(db_index=True, max_length=512),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=512, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['blog', 'is_reblog', '-note_count'], name='post_blog_reblog_notes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['blog', 'timestamp'], name='post_blog_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.0.5 on 2026-10-18 15:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tumblr_posts', '0010_auto_20261018_1457'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posts', models.IntegerField()),
+                ('notes', models.BigIntegerField()),
+                ('mean_notes', models.FloatField()),
+                ('median_notes', models.FloatField()),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tumblr_posts.Blog')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tumblr_posts.Tag')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TagPairSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posts', models.IntegerField()),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tumblr_posts.Blog')),
+                ('other_tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tumblr_posts.Tag')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tumblr_posts.Tag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tagsummary',
+            index=models.Index(fields=['blog', '-posts'], name='tagsummary_blog_posts_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagsummary',
+            unique_together={('blog', 'tag')},
+        ),
+        migrations.AddIndex(
+            model_name='tagpairsummary',
+            index=models.Index(fields=['blog', '-posts'], name='tagpairsummary_blog_posts_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagpairsummary',
+            unique_together={('blog', 'tag', 'other_tag')},
+        ),
+    ]
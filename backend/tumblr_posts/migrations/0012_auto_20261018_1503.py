@@ -0,0 +1,41 @@
+# Generated by Django 3.0.5 on 2026-10-18 15:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tumblr_posts', '0011_auto_20261018_1502'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteSnapshot',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('captured_at', models.IntegerField()),
+                ('note_count', models.IntegerField()),
+                ('post', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='tumblr_posts.Post')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BlogSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('captured_at', models.IntegerField()),
+                ('posts', models.IntegerField()),
+                ('notes', models.BigIntegerField()),
+                ('blog', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='tumblr_posts.Blog')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notesnapshot',
+            index=models.Index(fields=['post', 'captured_at'], name='notesnapshot_post_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blogsnapshot',
+            index=models.Index(fields=['blog', 'captured_at'], name='blogsnapshot_blog_time_idx'),
+        ),
+    ]
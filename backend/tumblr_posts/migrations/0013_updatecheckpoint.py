@@ -0,0 +1,28 @@
+# Generated by Django 3.0.5 on 2026-10-18 15:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tumblr_posts', '0012_auto_20261018_1503'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpdateCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.IntegerField()),
+                ('offset', models.IntegerField()),
+                ('posts', models.IntegerField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tumblr_posts.Blog')),
+            ],
+            options={
+                'unique_together': {('blog', 'start')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.5 on 2026-10-18 15:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tumblr_posts', '0013_updatecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='watchers',
+            field=models.ManyToManyField(blank=True, related_name='watched_blogs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='blog',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tumblr_posts', '0014_auto_20261018_1511'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='fingerprint',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -4,15 +4,17 @@ from backend.utils import shorten_string, shorten_post_url
 
 
 class Tag(models.Model):
-    name = models.CharField(max_length=512)
+    name = models.CharField(max_length=512, unique=True)
 
     def __str__(self):
         return self.name
 
 
 class Blog(models.Model):
-    user = models.ForeignKey(to=get_user_model(), on_delete=models.CASCADE)
-    blog_name = models.CharField(max_length=512)
+    user = models.ForeignKey(to=get_user_model(), on_delete=models.CASCADE, blank=True, null=True)
+    # Users who track statistics of the blog without owning it
+    watchers = models.ManyToManyField(to=get_user_model(), related_name='watched_blogs', blank=True)
+    blog_name = models.CharField(max_length=512, db_index=True)
     uuid = models.CharField(max_length=512, unique=True)
     title = models.CharField(max_length=512)
     is_primary = models.BooleanField()
@@ -20,6 +22,9 @@ class Blog(models.Model):
     followers = models.IntegerField()
     posts = models.IntegerField()
     updated = models.DateTimeField(auto_now=True)
+    last_post_id = models.BigIntegerField(blank=True, null=True)
+    last_post_timestamp = models.IntegerField(blank=True, null=True)
+    last_full_update = models.DateTimeField(blank=True, null=True)
 
     def __str__(self):
         return self.blog_name
@@ -40,10 +45,27 @@ class Post(models.Model):
     title = models.CharField(max_length=512, blank=True, null=True)
     summary = models.TextField(blank=True, null=True)
     slug = models.SlugField(max_length=255, blank=True, null=True)
+    # Hash of stored fields and tags, used to skip writing posts which haven't changed
+    fingerprint = models.BigIntegerField(blank=True, null=True)
 
-    def save(self, *args, **kwargs):
+    class Meta:
+        indexes = [
+            # Top posts: filter by blog and reblog flag, order by notes
+            models.Index(fields=['blog', 'is_reblog', '-note_count'], name='post_blog_reblog_notes_idx'),
+            # Notes graph: filter by blog, order by time
+            models.Index(fields=['blog', 'timestamp'], name='post_blog_timestamp_idx'),
+        ]
+
+    def normalize(self):
+        """
+        Bring fields to the form they are stored in. Called on save, should be called
+        explicitly before bulk operations, as they bypass save()
+        """
         self.title = shorten_string(self.title, 509)
         self.post_url = shorten_post_url(self.post_url)
+
+    def save(self, *args, **kwargs):
+        self.normalize()
         return super().save(*args, **kwargs)
 
     def get_tags(self):
@@ -51,3 +73,115 @@ class Post(models.Model):
 
     def __str__(self):
         return self.title or shorten_string(self.summary, 40) or 'Unnamed post'
+
+
+class UpdateCheckpoint(models.Model):
+    """
+    Progress of an unfinished full update (or its part starting at `start`).
+    `offset` is the offset of the next page to fetch, `posts` is posts count of the blog
+    at the moment, used to correct the offset for posts published since then
+    """
+    blog = models.ForeignKey(to=Blog, on_delete=models.CASCADE)
+    start = models.IntegerField()
+    offset = models.IntegerField()
+    posts = models.IntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('blog', 'start')
+
+    def __str__(self):
+        return f'{self.blog} from {self.start}: {self.offset}'
+
+
+class BlogStats(models.Model):
+    """
+    Blog statistics precomputed at the end of every posts update, so reading them
+    takes constant time regardless of blog size. Lists are stored serialized to JSON
+    """
+    blog = models.OneToOneField(to=Blog, on_delete=models.CASCADE, related_name='stats')
+    top_posts = models.TextField(default='[]')
+    top_posts_with_reblogs = models.TextField(default='[]')
+    notes = models.TextField(default='[]')
+    notes_with_reblogs = models.TextField(default='[]')
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Statistics for {self.blog}'
+
+
+class TagSummary(models.Model):
+    """
+    Per-blog tag statistics. Rebuilt for changed tags at the end of every posts update
+    """
+    blog = models.ForeignKey(to=Blog, on_delete=models.CASCADE)
+    tag = models.ForeignKey(to=Tag, on_delete=models.CASCADE)
+    posts = models.IntegerField()
+    notes = models.BigIntegerField()
+    mean_notes = models.FloatField()
+    median_notes = models.FloatField()
+
+    class Meta:
+        unique_together = ('blog', 'tag')
+        indexes = [
+            models.Index(fields=['blog', '-posts'], name='tagsummary_blog_posts_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag} in {self.blog}'
+
+
+class TagPairSummary(models.Model):
+    """
+    Per-blog count of posts tagged with both tags of a pair. Tag with lower id always goes first
+    """
+    blog = models.ForeignKey(to=Blog, on_delete=models.CASCADE)
+    tag = models.ForeignKey(to=Tag, on_delete=models.CASCADE, related_name='+')
+    other_tag = models.ForeignKey(to=Tag, on_delete=models.CASCADE, related_name='+')
+    posts = models.IntegerField()
+
+    class Meta:
+        unique_together = ('blog', 'tag', 'other_tag')
+        indexes = [
+            models.Index(fields=['blog', '-posts'], name='tagpairsummary_blog_posts_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag} + {self.other_tag} in {self.blog}'
+
+
+class NoteSnapshot(models.Model):
+    """
+    Note count of a post at some moment. Snapshots are written only when note count changes,
+    so note count stays the same until the next snapshot
+    """
+    id = models.BigAutoField(primary_key=True)
+    post = models.ForeignKey(to=Post, on_delete=models.CASCADE, db_index=False)
+    captured_at = models.IntegerField()  # unix timestamp
+    note_count = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'captured_at'], name='notesnapshot_post_time_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.post_id} at {self.captured_at}: {self.note_count}'
+
+
+class BlogSnapshot(models.Model):
+    """
+    Total count of posts and notes of a blog at some moment
+    """
+    blog = models.ForeignKey(to=Blog, on_delete=models.CASCADE, db_index=False)
+    captured_at = models.IntegerField()  # unix timestamp
+    posts = models.IntegerField()
+    notes = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['blog', 'captured_at'], name='blogsnapshot_blog_time_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.blog} at {self.captured_at}: {self.notes}'
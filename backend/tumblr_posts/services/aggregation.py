@@ -0,0 +1,101 @@
+import statistics
+from collections import defaultdict
+from typing import Dict, List
+from django.db import connection
+from django.db.models import Aggregate, Avg, Count, FloatField, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from tumblr_posts.models import Blog, Post
+
+
+class Median(Aggregate):
+    """
+    Median aggregate, available on PostgreSQL only
+    """
+    function = 'PERCENTILE_CONT'
+    name = 'median'
+    output_field = FloatField()
+    template = '%(function)s(0.5) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+
+class AggregationService:
+    """
+    Aggregation service which is responsible for computing blog statistics per time period.
+    All aggregation is done by database, so cost depends on the count of periods rather than posts
+    """
+    PERIODS = {
+        'day': TruncDay,
+        'week': TruncWeek,
+        'month': TruncMonth,
+    }
+
+    @staticmethod
+    def has_median() -> bool:
+        return connection.vendor == 'postgresql'
+
+    @staticmethod
+    def _get_aggregates() -> dict:
+        return dict(
+            posts=Count('id'),
+            originals=Count('id', filter=Q(is_reblog=False)),
+            reblogs=Count('id', filter=Q(is_reblog=True)),
+            notes=Sum('note_count'),
+            mean_notes=Avg('note_count'),
+        )
+
+    def _get_medians(self, posts) -> Dict:
+        """
+        Compute median notes per period in Python. Fallback for databases without median aggregate
+
+        :param posts: posts queryset annotated with period
+        :return: mapping of period to median notes
+        """
+        notes = defaultdict(list)
+        for period, note_count in posts.values_list('period', 'note_count').iterator():
+            notes[period].append(note_count)
+        return {period: statistics.median(counts) for period, counts in notes.items()}
+
+    @staticmethod
+    def _format(row: dict) -> dict:
+        row['notes'] = row['notes'] or 0
+        row['mean_notes'] = round(row['mean_notes'] or 0, 2)
+        row['median_notes'] = row['median_notes'] or 0
+        return row
+
+    def get_period_stats(self, blog: Blog, period: str = 'month') -> List[dict]:
+        """
+        Get posts and notes statistics of the blog per time period
+
+        :param blog: Blog object
+        :param period: one of 'day', 'week', 'month'
+        :return: list of periods with their start date, posts count, originals and reblogs counts,
+            total, mean and median notes
+        """
+        posts = Post.objects.filter(blog=blog).annotate(period=self.PERIODS[period]('date'))
+        aggregates = self._get_aggregates()
+        if self.has_median():
+            aggregates['median_notes'] = Median('note_count')
+        rows = list(posts.values('period').annotate(**aggregates).order_by('period'))
+        if not self.has_median():
+            medians = self._get_medians(posts)
+            for row in rows:
+                row['median_notes'] = medians.get(row['period'])
+        for row in rows:
+            row['period'] = row['period'].isoformat()
+        return [self._format(row) for row in rows]
+
+    def get_summary(self, blog: Blog) -> dict:
+        """
+        Get posts and notes statistics of the blog for the whole time
+
+        :param blog: Blog object
+        :return: posts count, originals and reblogs counts, total, mean and median notes
+        """
+        posts = Post.objects.filter(blog=blog)
+        aggregates = self._get_aggregates()
+        if self.has_median():
+            aggregates['median_notes'] = Median('note_count')
+        summary = posts.aggregate(**aggregates)
+        if not self.has_median():
+            notes = list(posts.values_list('note_count', flat=True).iterator())
+            summary['median_notes'] = statistics.median(notes) if notes else None
+        return self._format(summary)
@@ -0,0 +1,81 @@
+import json
+import multiprocessing
+from collections import deque
+from functools import partial
+from typing import Iterator, List, Optional
+
+# Fields of post payload used by ingest, the rest is dropped right after parsing
+POST_FIELDS = (
+    'id', 'blog_name', 'post_url', 'date', 'timestamp', 'summary', 'slug', 'title',
+    'note_count', 'tags', 'mobile', 'reblogged_from_id',
+)
+
+
+def _extract_posts(value, blog_name: str) -> List[dict]:
+    """
+    Get posts of the blog from a value found in a dump: a post, a list of posts,
+    a page of posts (`/posts` API response) or a list of pages
+
+    :param value: decoded JSON value
+    :param blog_name: name of the blog, posts of other blogs are skipped
+    :return: posts payloads with only POST_FIELDS kept
+    """
+    if isinstance(value, list):
+        return [post for item in value for post in _extract_posts(item, blog_name)]
+    if not isinstance(value, dict):
+        return []
+    if 'response' in value:
+        return _extract_posts(value['response'], blog_name)
+    if 'posts' in value:
+        return _extract_posts(value['posts'], blog_name)
+    if 'id' not in value or value.get('blog_name', blog_name) != blog_name:
+        return []
+    return [{field: value[field] for field in POST_FIELDS if field in value}]
+
+
+def _parse_lines(lines: List[str], blog_name: str) -> List[dict]:
+    return [post for line in lines if line.strip() for post in _extract_posts(json.loads(line), blog_name)]
+
+
+class DumpReader:
+    """
+    Reader of posts dumped from Tumblr API, either as a single JSON document or as JSON lines.
+    JSON lines are parsed by a pool of processes, at most `processes * 2` batches
+    of lines are read ahead, so memory used doesn't depend on dump size
+    """
+    LINES_SUFFIXES = ('.jsonl', '.ndjson')
+
+    def __init__(self, path: str, blog_name: str, processes: Optional[int] = None, batch_size: int = 1000):
+        """
+        :param path: path to the dump
+        :param blog_name: name of the blog, posts of other blogs are skipped
+        :param processes: count of parsing processes, CPU count by default
+        :param batch_size: lines parsed by a process at once
+        """
+        self.path = path
+        self.blog_name = blog_name
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+
+    def read(self) -> Iterator[List[dict]]:
+        """
+        Read posts from the dump in order
+
+        :return: iterator over batches of posts payloads
+        """
+        if not self.path.endswith(self.LINES_SUFFIXES):
+            with open(self.path) as f:
+                posts = _extract_posts(json.load(f), self.blog_name)
+            for start in range(0, len(posts), self.batch_size):
+                yield posts[start:start + self.batch_size]
+            return
+        parse = partial(_parse_lines, blog_name=self.blog_name)
+        with open(self.path) as f, multiprocessing.Pool(self.processes) as pool:
+            batches = iter(lambda: [line for _, line in zip(range(self.batch_size), f)], [])
+            in_flight = deque()
+            for batch in batches:
+                in_flight.append(pool.apply_async(parse, (batch,)))
+                if len(in_flight) >= self.processes * 2:
+                    yield in_flight.popleft().get()
+            while in_flight:
+                yield in_flight.popleft().get()
@@ -0,0 +1,141 @@
+import csv
+import io
+import itertools
+from typing import Iterable, Iterator, List
+from django.conf import settings
+from tumblr_posts.models import Blog, NoteSnapshot, Post
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet and Arrow exports are available only if pyarrow is installed
+    pyarrow = None
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Write-only file keeping only data written since the last drain, so a file
+    can be streamed while it's being written. Position keeps counting all written data,
+    as writers use it for offsets within the file
+    """
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class ExportService:
+    """
+    Export service which is responsible for dumping blog data for offline analysis.
+    Rows are read with server-side cursors and written in chunks of EXPORT_CHUNK_SIZE,
+    so memory used doesn't depend on blog size
+    """
+    DATASETS = {
+        # dataset: [(column, Arrow type)]
+        'posts': [
+            ('id', 'int64'), ('post_url', 'string'), ('type', 'string'), ('timestamp', 'int64'),
+            ('date', 'date32'), ('mobile', 'bool'), ('is_reblog', 'bool'), ('note_count', 'int64'),
+            ('title', 'string'), ('summary', 'string'), ('slug', 'string'),
+        ],
+        'tags': [('post_id', 'int64'), ('tag', 'string')],
+        'notes': [('post_id', 'int64'), ('captured_at', 'int64'), ('note_count', 'int64')],
+    }
+    FORMATS = ('csv', 'parquet', 'arrow')
+    CONTENT_TYPES = {
+        'csv': 'text/csv',
+        'parquet': 'application/vnd.apache.parquet',
+        'arrow': 'application/vnd.apache.arrow.stream',
+    }
+
+    def __init__(self):
+        self.chunk_size = settings.EXPORT_CHUNK_SIZE
+
+    @staticmethod
+    def is_available(fmt: str) -> bool:
+        """
+        Check whether export to the format is possible
+
+        :param fmt: one of FORMATS
+        :return: False if a library needed for the format isn't installed
+        """
+        return fmt == 'csv' or pyarrow is not None
+
+    def _get_rows(self, blog: Blog, dataset: str) -> Iterator[tuple]:
+        if dataset == 'posts':
+            queryset = Post.objects.filter(blog=blog).order_by('id').values_list(
+                *[column for column, _ in self.DATASETS['posts']])
+        elif dataset == 'tags':
+            queryset = Post.tags.through.objects.filter(post__blog=blog).order_by('post_id').values_list(
+                'post_id', 'tag__name')
+        else:
+            queryset = NoteSnapshot.objects.filter(post__blog=blog).order_by('post_id', 'captured_at').values_list(
+                'post_id', 'captured_at', 'note_count')
+        return queryset.iterator(chunk_size=self.chunk_size)
+
+    def _get_chunks(self, rows: Iterable[tuple]) -> Iterator[List[tuple]]:
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def export(self, blog: Blog, dataset: str, fmt: str) -> Iterator[bytes]:
+        """
+        Export dataset of the blog. The file is produced part by part while the result is iterated
+
+        :param blog: Blog object
+        :param dataset: one of DATASETS: posts, tags of posts or history of posts note counts
+        :param fmt: one of FORMATS: CSV, Parquet or Arrow IPC stream
+        :return: iterator over parts of the file
+        """
+        chunks = self._get_chunks(self._get_rows(blog, dataset))
+        if fmt == 'csv':
+            return self._write_csv(dataset, chunks)
+        return self._write_arrow(dataset, chunks, parquet=fmt == 'parquet')
+
+    def _write_csv(self, dataset: str, chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([column for column, _ in self.DATASETS[dataset]])
+        for chunk in chunks:
+            writer.writerows(chunk)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode()
+
+    def _write_arrow(self, dataset: str, chunks: Iterator[List[tuple]], parquet: bool) -> Iterator[bytes]:
+        schema = pyarrow.schema([(column, pyarrow.type_for_alias(type_)) for column, type_ in self.DATASETS[dataset]])
+        sink = ChunkSink()
+        if parquet:
+            writer = pyarrow.parquet.ParquetWriter(sink, schema)
+        else:
+            writer = pyarrow.ipc.new_stream(sink, schema)
+        for chunk in chunks:
+            columns = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+            batch = pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+            if parquet:
+                # Every chunk becomes a row group
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
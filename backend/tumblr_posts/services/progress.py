@@ -0,0 +1,109 @@
+import time
+from typing import Optional
+from django.conf import settings
+from backend.clients import get_redis
+
+
+class ProgressService:
+    """
+    Progress service which is responsible for reporting progress of posts updates.
+    Progress is kept in Redis hash per blog, so it can be read without touching the database
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    FINAL_STATES = (DONE, FAILED)
+
+    def __init__(self):
+        self.redis = get_redis(decode_responses=True)
+        self.progress_key = 'update-progress-{}'
+        self.ttl = settings.UPDATE_PROGRESS_TTL
+
+    def _set(self, blog_name: str, **fields) -> None:
+        key = self.progress_key.format(blog_name)
+        fields['updated'] = time.time()
+        with self.redis.pipeline() as pipe:
+            pipe.hset(key, mapping=fields)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def queue(self, blog_name: str) -> None:
+        """
+        Report that update was requested and waits for a worker
+
+        :param blog_name: blog name
+        """
+        self.redis.delete(self.progress_key.format(blog_name))
+        self._set(blog_name, state=self.QUEUED)
+
+    def start(self, blog_name: str, total: int, full: bool) -> None:
+        """
+        Report that update was started
+
+        :param blog_name: blog name
+        :param total: expected count of posts to fetch
+        :param full: whether all posts are re-fetched
+        """
+        self.redis.delete(self.progress_key.format(blog_name))
+        self._set(blog_name, state=self.RUNNING, full=int(full), total=max(total, 0),
+                  pages=0, posts=0, started=time.time())
+
+    def add_page(self, blog_name: str, posts_count: int) -> None:
+        """
+        Report that a page of posts was fetched and saved
+
+        :param blog_name: blog name
+        :param posts_count: count of posts written
+        """
+        key = self.progress_key.format(blog_name)
+        with self.redis.pipeline() as pipe:
+            pipe.hincrby(key, 'pages', 1)
+            pipe.hincrby(key, 'posts', posts_count)
+            pipe.hset(key, 'updated', time.time())
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def finish(self, blog_name: str) -> None:
+        """
+        Report that update was finished successfully
+
+        :param blog_name: blog name
+        """
+        self._set(blog_name, state=self.DONE, finished=time.time())
+
+    def fail(self, blog_name: str) -> None:
+        """
+        Report that update has failed
+
+        :param blog_name: blog name
+        """
+        self._set(blog_name, state=self.FAILED, finished=time.time())
+
+    def get_progress(self, blog_name: str) -> Optional[dict]:
+        """
+        Get progress of the latest update of the blog
+
+        :param blog_name: blog name
+        :return: state, pages fetched, posts written, expected total and remaining count of posts
+            and estimated seconds left, None if the blog wasn't updated recently
+        """
+        raw = self.redis.hgetall(self.progress_key.format(blog_name))
+        if not raw:
+            return None
+        progress = {'state': raw['state'], 'updated': float(raw['updated'])}
+        if 'started' not in raw:
+            return progress
+        posts, total, started = int(raw['posts']), int(raw['total']), float(raw['started'])
+        remaining = 0 if raw['state'] in self.FINAL_STATES else max(total - posts, 0)
+        elapsed = float(raw.get('finished', raw['updated'])) - started
+        progress.update({
+            'full': bool(int(raw['full'])),
+            'pages': int(raw['pages']),
+            'posts': posts,
+            'total': total,
+            'remaining': remaining,
+            'eta': round(elapsed / posts * remaining) if posts and remaining else None,
+            'started': started,
+        })
+        return progress
@@ -0,0 +1,84 @@
+import random
+import time
+from typing import List, Optional
+from django.conf import settings
+from django.db.models import Q
+from backend.clients import get_redis
+from tumblr_posts.models import Blog, Post
+
+
+class SchedulerService:
+    """
+    Scheduler service which is responsible for planning periodic updates of blogs.
+    Planned update times are kept in Redis sorted set per blog, and depend on activity of the blog:
+    blogs which are posted to often are updated often, dormant blogs are updated rarely
+    """
+    def __init__(self):
+        self.redis = get_redis()
+        self.schedule_key = 'update-schedule-blogs'
+        self.min_interval = settings.SCHEDULED_UPDATE_MIN_INTERVAL
+        self.max_interval = settings.SCHEDULED_UPDATE_MAX_INTERVAL
+        self.activity_window = settings.SCHEDULED_UPDATE_ACTIVITY_WINDOW
+        self.batch_size = settings.SCHEDULED_UPDATES_PER_TICK
+
+    def get_interval(self, blog: Blog, now: Optional[float] = None) -> float:
+        """
+        Get interval between updates of the blog. Active blogs are updated about as often as
+        they get new posts. Blogs without recent posts are updated less often the longer they are dormant
+
+        :param blog: Blog object
+        :param now: current time (unix timestamp), defaults to now
+        :return: interval in seconds
+        """
+        if now is None:
+            now = time.time()
+        recent = Post.objects.filter(blog=blog, timestamp__gte=now - self.activity_window).count()
+        if recent:
+            interval = self.activity_window / recent
+        else:
+            interval = (now - (blog.last_post_timestamp or 0)) / 2
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    @staticmethod
+    def _get_tracked_blogs():
+        # Blogs of users and public blogs watched by someone, others have nobody to be updated for
+        return Blog.objects.filter(Q(user__isnull=False) | Q(watchers__isnull=False)).distinct()
+
+    def sync(self, now: Optional[float] = None) -> None:
+        """
+        Add blogs which aren't scheduled yet to the schedule and remove deleted or abandoned ones.
+        First updates of new blogs are spread randomly over the minimum interval to avoid bursts
+
+        :param now: current time (unix timestamp), defaults to now
+        """
+        if now is None:
+            now = time.time()
+        blog_ids = set(self._get_tracked_blogs().values_list('pk', flat=True))
+        scheduled = {int(blog_id) for blog_id in self.redis.zrange(self.schedule_key, 0, -1)}
+        new = {blog_id: now + random.uniform(0, self.min_interval) for blog_id in blog_ids - scheduled}
+        if new:
+            self.redis.zadd(self.schedule_key, new, nx=True)
+        if scheduled - blog_ids:
+            self.redis.zrem(self.schedule_key, *(scheduled - blog_ids))
+
+    def pop_due(self, now: Optional[float] = None) -> List[Blog]:
+        """
+        Get blogs which are due to be updated and plan their next updates.
+        At most SCHEDULED_UPDATES_PER_TICK blogs are returned, the rest stay due
+
+        :param now: current time (unix timestamp), defaults to now
+        :return: Blog objects to update
+        """
+        if now is None:
+            now = time.time()
+        blog_ids = [int(blog_id) for blog_id in
+                    self.redis.zrangebyscore(self.schedule_key, 0, now, start=0, num=self.batch_size)]
+        blogs = list(self._get_tracked_blogs().filter(pk__in=blog_ids))
+        # Jitter keeps updates of blogs with equal intervals from lining up
+        schedule = {blog.pk: now + self.get_interval(blog, now) * random.uniform(0.9, 1.1) for blog in blogs}
+        if schedule:
+            self.redis.zadd(self.schedule_key, schedule)
+        missing = set(blog_ids) - schedule.keys()
+        if missing:
+            self.redis.zrem(self.schedule_key, *missing)
+        return blogs
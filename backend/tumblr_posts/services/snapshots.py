@@ -0,0 +1,126 @@
+import time
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Sum
+from tumblr_posts.models import Blog, BlogSnapshot, NoteSnapshot, Post
+
+
+class SnapshotService:
+    """
+    Snapshot service which is responsible for keeping history of note counts
+    """
+    def __init__(self):
+        self.batch_size = settings.POSTS_BULK_CHUNK_SIZE
+        self.downsampling = settings.SNAPSHOTS_DOWNSAMPLING
+
+    def record(self, blog: Blog, note_counts: Dict[int, int], captured_at: Optional[int] = None) -> None:
+        """
+        Record snapshots of changed note counts. Should be called at the end of posts update
+
+        :param blog: Blog object
+        :param note_counts: new note counts of posts which were created or which note counts changed
+        :param captured_at: snapshot time (unix timestamp), defaults to now
+        """
+        if not note_counts:
+            return
+        if captured_at is None:
+            captured_at = int(time.time())
+        with transaction.atomic():
+            self.record_posts(note_counts, captured_at)
+            self.record_blog(blog, captured_at)
+
+    def record_posts(self, note_counts: Dict[int, int], captured_at: Optional[int] = None) -> None:
+        """
+        Record snapshots of changed note counts of posts only
+
+        :param note_counts: new note counts of posts which were created or which note counts changed
+        :param captured_at: snapshot time (unix timestamp), defaults to now
+        """
+        if captured_at is None:
+            captured_at = int(time.time())
+        NoteSnapshot.objects.bulk_create([
+            NoteSnapshot(post_id=post_id, captured_at=captured_at, note_count=note_count)
+            for post_id, note_count in note_counts.items()
+        ], batch_size=self.batch_size)
+
+    @staticmethod
+    def record_blog(blog: Blog, captured_at: Optional[int] = None) -> None:
+        """
+        Record snapshot of total posts and notes counts of the blog
+
+        :param blog: Blog object
+        :param captured_at: snapshot time (unix timestamp), defaults to now
+        """
+        if captured_at is None:
+            captured_at = int(time.time())
+        totals = Post.objects.filter(blog=blog).aggregate(posts=Count('id'), notes=Sum('note_count'))
+        BlogSnapshot.objects.create(blog=blog, captured_at=captured_at, posts=totals['posts'],
+                                    notes=totals['notes'] or 0)
+
+    @staticmethod
+    def get_post_growth(post: Post) -> List[List[int]]:
+        """
+        Get history of post notes
+
+        :param post: Post object
+        :return: list of [unix timestamp, note count] pairs ordered by time
+        """
+        snapshots = NoteSnapshot.objects.filter(post=post).order_by('captured_at')
+        return [list(snapshot) for snapshot in snapshots.values_list('captured_at', 'note_count')]
+
+    @staticmethod
+    def get_blog_growth(blog: Blog) -> List[List[int]]:
+        """
+        Get history of total blog notes and posts
+
+        :param blog: Blog object
+        :return: list of [unix timestamp, posts count, notes count] ordered by time
+        """
+        snapshots = BlogSnapshot.objects.filter(blog=blog).order_by('captured_at')
+        return [list(snapshot) for snapshot in snapshots.values_list('captured_at', 'posts', 'notes')]
+
+    def _downsample(self, snapshots, owner: str, interval: int) -> int:
+        """
+        Delete all but the last snapshot of every owner within every interval.
+        Owners are processed in batches, and snapshots are deleted by ids in batches,
+        so no single statement scans or locks the whole table
+
+        :param snapshots: queryset of snapshots to downsample
+        :param owner: name of the field snapshots belong to
+        :param interval: interval length in seconds
+        :return: count of deleted snapshots
+        """
+        owner_id = f'{owner}_id'
+        bucketed = snapshots.annotate(interval=F('captured_at') / interval)
+        later = bucketed.filter(id__gt=OuterRef('id'), interval=OuterRef('interval'), **{owner_id: OuterRef(owner_id)})
+        deleted = 0
+        last_owner = None
+        while True:
+            owners = snapshots.order_by(owner_id).values_list(owner_id, flat=True).distinct()
+            if last_owner is not None:
+                owners = owners.filter(**{f'{owner_id}__gt': last_owner})
+            owners = list(owners[:self.batch_size])
+            if not owners:
+                return deleted
+            last_owner = owners[-1]
+            outdated = bucketed.filter(Exists(later), **{f'{owner_id}__in': owners}).values_list('id', flat=True)
+            outdated = list(outdated)
+            for start in range(0, len(outdated), self.batch_size):
+                count, _ = snapshots.model.objects.filter(id__in=outdated[start:start + self.batch_size]).delete()
+                deleted += count
+
+    def prune(self, now: Optional[int] = None) -> int:
+        """
+        Apply downsampling policies (SNAPSHOTS_DOWNSAMPLING) to old snapshots
+
+        :param now: current time (unix timestamp), defaults to now
+        :return: count of deleted snapshots
+        """
+        if now is None:
+            now = int(time.time())
+        deleted = 0
+        for age, interval in self.downsampling:
+            deleted += self._downsample(NoteSnapshot.objects.filter(captured_at__lt=now - age), 'post', interval)
+            deleted += self._downsample(BlogSnapshot.objects.filter(captured_at__lt=now - age), 'blog', interval)
+        return deleted
@@ -0,0 +1,120 @@
+import json
+from typing import List, Optional
+from django.db.models import Avg, BigIntegerField, Count, F, Max, Min
+from django.db.models.functions import Cast
+from tumblr_posts.models import Blog, BlogStats, Post
+
+
+class StatsService:
+    """
+    Statistics service which is responsible for precomputing blog statistics
+    """
+    def __init__(self):
+        self.top_posts_count = 50
+
+    @staticmethod
+    def _get_posts(blog: Blog, exclude_reblogs: bool):
+        posts = Post.objects.filter(blog=blog)
+        if exclude_reblogs:
+            posts = posts.filter(is_reblog=False)
+        return posts
+
+    def compute_top_posts(self, blog: Blog, exclude_reblogs=True) -> List[dict]:
+        """
+        Compute posts top for blog
+
+        :param blog: Blog object
+        :param exclude_reblogs: exclude reblogs
+        :return: list of top posts, longest top ever requested
+        """
+        posts = self._get_posts(blog, exclude_reblogs).order_by('-note_count')
+        return [
+            {
+                'title': str(post),
+                'note_count': post.note_count,
+                'url': post.post_url,
+            }
+            for post in posts[:self.top_posts_count]
+        ]
+
+    def compute_notes(self, blog: Blog, exclude_reblogs=True) -> List[int]:
+        """
+        Compute notes counts on all posts ordered by post time
+
+        :param blog: Blog object
+        :param exclude_reblogs: exclude reblogs
+        :return: list of notes counts
+        """
+        posts = self._get_posts(blog, exclude_reblogs).order_by('timestamp')
+        return list(posts.values_list('note_count', flat=True))
+
+    def compute_notes_buckets(self, blog: Blog, points: int, since: Optional[int] = None,
+                              until: Optional[int] = None, exclude_reblogs=True) -> List[dict]:
+        """
+        Compute downsampled notes series: posts within time range are split into `points`
+        equal time buckets, and each bucket is aggregated by the database
+
+        :param blog: Blog object
+        :param points: maximum count of buckets
+        :param since: start of time range (unix timestamp), defaults to the oldest post
+        :param until: end of time range (unix timestamp), defaults to the newest post
+        :param exclude_reblogs: exclude reblogs
+        :return: list of buckets with their start time, posts count and min, max and mean notes
+        """
+        posts = self._get_posts(blog, exclude_reblogs)
+        if since is None or until is None:
+            bounds = posts.aggregate(first=Min('timestamp'), last=Max('timestamp'))
+            since = bounds['first'] if since is None else since
+            until = bounds['last'] if until is None else until
+            if since is None or until is None:
+                return []
+        posts = posts.filter(timestamp__gte=since, timestamp__lte=until)
+        span = until - since + 1
+        buckets = posts.annotate(
+            bucket=Cast(F('timestamp') - since, BigIntegerField()) * points / span,
+        ).values('bucket').annotate(
+            posts=Count('id'),
+            min=Min('note_count'),
+            max=Max('note_count'),
+            mean=Avg('note_count'),
+        ).order_by('bucket')
+        return [
+            {
+                'timestamp': since + bucket['bucket'] * span // points,
+                'posts': bucket['posts'],
+                'min': bucket['min'],
+                'max': bucket['max'],
+                'mean': round(bucket['mean'], 2),
+            }
+            for bucket in buckets
+        ]
+
+    def refresh_stats(self, blog: Blog) -> BlogStats:
+        """
+        Recompute statistics of the blog. Should be called after blog posts are updated
+
+        :param blog: Blog object
+        :return: BlogStats object
+        """
+        stats, created = BlogStats.objects.update_or_create(
+            blog=blog,
+            defaults={
+                'top_posts': json.dumps(self.compute_top_posts(blog), ensure_ascii=False),
+                'top_posts_with_reblogs': json.dumps(self.compute_top_posts(blog, False), ensure_ascii=False),
+                'notes': json.dumps(self.compute_notes(blog)),
+                'notes_with_reblogs': json.dumps(self.compute_notes(blog, False)),
+            },
+        )
+        return stats
+
+    def get_stats(self, blog: Blog) -> BlogStats:
+        """
+        Get precomputed statistics of the blog, computing them if they are missing
+
+        :param blog: Blog object
+        :return: BlogStats object
+        """
+        try:
+            return BlogStats.objects.get(blog=blog)
+        except BlogStats.DoesNotExist:
+            return self.refresh_stats(blog)
@@ -0,0 +1,158 @@
+import statistics
+from collections import defaultdict
+from typing import Iterable, List, Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Q, Sum
+from tumblr_posts.models import Blog, Post, TagSummary, TagPairSummary
+from tumblr_posts.services.aggregation import AggregationService, Median
+
+
+class TagStatsService:
+    """
+    Tag statistics service which is responsible for maintaining per-blog tag summaries
+    """
+    ORDERS = ('posts', 'notes', 'mean_notes', 'median_notes')
+
+    def __init__(self):
+        self.pairs_min_posts = settings.TAG_PAIRS_MIN_POSTS
+        self.batch_size = settings.POSTS_BULK_CHUNK_SIZE
+
+    @staticmethod
+    def _get_tagged_posts(blog: Blog):
+        return Post.tags.through.objects.filter(post__blog=blog)
+
+    def _compute_summaries(self, blog: Blog, tag_ids: Optional[List[int]]) -> List[TagSummary]:
+        """
+        Compute statistics of the tags in the blog
+
+        :param blog: Blog object
+        :param tag_ids: ids of tags to compute statistics for, None for all tags
+        :return: list of unsaved TagSummary objects
+        """
+        tagged = self._get_tagged_posts(blog)
+        if tag_ids is not None:
+            tagged = tagged.filter(tag_id__in=tag_ids)
+        aggregates = dict(
+            posts=Count('post_id'),
+            notes=Sum('post__note_count'),
+            mean_notes=Avg('post__note_count'),
+        )
+        has_median = AggregationService.has_median()
+        if has_median:
+            aggregates['median_notes'] = Median('post__note_count')
+        rows = tagged.values('tag_id').annotate(**aggregates).order_by()
+        if not has_median:
+            notes = defaultdict(list)
+            for tag_id, note_count in tagged.values_list('tag_id', 'post__note_count').iterator():
+                notes[tag_id].append(note_count)
+        return [
+            TagSummary(
+                blog=blog,
+                tag_id=row['tag_id'],
+                posts=row['posts'],
+                notes=row['notes'],
+                mean_notes=row['mean_notes'],
+                median_notes=row['median_notes'] if has_median else statistics.median(notes[row['tag_id']]),
+            )
+            for row in rows
+        ]
+
+    def _compute_pairs(self, blog: Blog, tag_ids: Optional[List[int]]) -> List[TagPairSummary]:
+        """
+        Compute co-occurrence of tag pairs involving any of the tags in the blog
+
+        :param blog: Blog object
+        :param tag_ids: ids of tags to compute pairs for, None for all tags
+        :return: list of unsaved TagPairSummary objects
+        """
+        # Joining posts back to their tags gives every pair of tags of each post.
+        # Conditions on the joined tags must be in a single filter() call to use the same join
+        conditions = Q(post__tags__gt=F('tag_id'))
+        if tag_ids is not None:
+            conditions &= Q(tag_id__in=tag_ids) | Q(post__tags__in=tag_ids)
+        pairs = self._get_tagged_posts(blog).filter(conditions).values('tag_id', 'post__tags').annotate(
+            posts=Count('post_id'),
+        ).filter(posts__gte=self.pairs_min_posts)
+        return [
+            TagPairSummary(blog=blog, tag_id=row['tag_id'], other_tag_id=row['post__tags'], posts=row['posts'])
+            for row in pairs.order_by()
+        ]
+
+    def refresh_tags(self, blog: Blog, tag_ids: Iterable[int]) -> None:
+        """
+        Rebuild statistics of the tags and pairs involving them. Should be called
+        after blog posts are updated with ids of tags of changed posts
+
+        :param blog: Blog object
+        :param tag_ids: ids of tags to rebuild statistics for
+        """
+        tag_ids = list(tag_ids)
+        if tag_ids:
+            self._rebuild(blog, tag_ids)
+
+    def refresh_blog(self, blog: Blog) -> None:
+        """
+        Rebuild statistics of all tags of the blog. Should be called after full update of blog posts
+
+        :param blog: Blog object
+        """
+        self._rebuild(blog, None)
+
+    def _rebuild(self, blog: Blog, tag_ids: Optional[List[int]]) -> None:
+        """
+        Replace statistics of the tags and pairs involving them
+
+        :param blog: Blog object
+        :param tag_ids: ids of tags to rebuild statistics for, None for all tags
+        """
+        summaries = self._compute_summaries(blog, tag_ids)
+        pairs = self._compute_pairs(blog, tag_ids)
+        old_summaries = TagSummary.objects.filter(blog=blog)
+        old_pairs = TagPairSummary.objects.filter(blog=blog)
+        if tag_ids is not None:
+            old_summaries = old_summaries.filter(tag_id__in=tag_ids)
+            old_pairs = old_pairs.filter(Q(tag_id__in=tag_ids) | Q(other_tag_id__in=tag_ids))
+        with transaction.atomic():
+            old_summaries.delete()
+            TagSummary.objects.bulk_create(summaries, batch_size=self.batch_size)
+            old_pairs.delete()
+            TagPairSummary.objects.bulk_create(pairs, batch_size=self.batch_size)
+
+    def get_top_tags(self, blog: Blog, order: str = 'posts', count=20) -> List[dict]:
+        """
+        Get best performing tags of the blog
+
+        :param blog: Blog object
+        :param order: field to order tags by, one of ORDERS
+        :param count: count of tags to get
+        :return: list of tags with their posts count, total, mean and median notes
+        """
+        summaries = TagSummary.objects.filter(blog=blog).select_related('tag').order_by(f'-{order}', 'tag_id')
+        return [
+            {
+                'tag': summary.tag.name,
+                'posts': summary.posts,
+                'notes': summary.notes,
+                'mean_notes': round(summary.mean_notes, 2),
+                'median_notes': summary.median_notes,
+            }
+            for summary in summaries[:count]
+        ]
+
+    def get_top_pairs(self, blog: Blog, count=20) -> List[dict]:
+        """
+        Get tag pairs used together most often in the blog
+
+        :param blog: Blog object
+        :param count: count of pairs to get
+        :return: list of pairs with count of posts tagged with both tags
+        """
+        pairs = TagPairSummary.objects.filter(blog=blog).select_related('tag', 'other_tag').order_by('-posts', 'id')
+        return [
+            {
+                'tags': [pair.tag.name, pair.other_tag.name],
+                'posts': pair.posts,
+            }
+            for pair in pairs[:count]
+        ]
@@ -1,48 +1,169 @@
-from typing import List, Optional
+import copy
+import hashlib
+import itertools
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from tumblr_posts.models import Post, Tag, Blog
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests import RequestException
+from backend.cache import ResponseCache
+from backend.clients import get_redis
+from backend.instrumentation import bind
+from backend.memo import TTLCache, discard_scoped, get_scoped, set_scoped
+from tumblr_posts.models import Post, Tag, Blog, UpdateCheckpoint
+from tumblr_posts.services.progress import ProgressService
+from tumblr_posts.services.snapshots import SnapshotService
+from tumblr_posts.services.stats import StatsService
+from tumblr_posts.services.tags import TagStatsService
 from tumblr_auth.services.auth import AuthService
-import pytumblr
 import datetime
-from redis import Redis
 
 
 user_model = get_user_model()
+_blogs = TTLCache()  # (user id, blog name): (data version, Blog)
 
 
 class LimitError(RuntimeError):
     pass
 
 
+class TumblrError(RuntimeError):
+    """
+    Tumblr API responded with an error
+    """
+    pass
+
+
+class TransientTumblrError(TumblrError):
+    """
+    Tumblr API is temporarily unavailable, request can be retried later
+    """
+    pass
+
+
+class IngestChanges:
+    """
+    Changes made by posts ingest. Used for updating derived data once ingest is finished
+    """
+    def __init__(self):
+        self.tags = set()  # ids of tags which posts were changed
+        self.note_counts = {}  # new note counts of posts which were created or which note counts changed
+
+    def update(self, other: 'IngestChanges') -> None:
+        self.tags |= other.tags
+        self.note_counts.update(other.note_counts)
+
+
 class PostsService:
     """
     Posts service which is responsible for getting information about posts
     """
     def __init__(self):
-        self.api_key = settings.TUMBLR_CONSUMER_KEY
-        self.client = pytumblr.TumblrRestClient(self.api_key)
+        self.client = AuthService.get_api_client()
         self.interval = settings.MIN_POSTS_UPDATE_INTERVAL
-        self.redis = Redis(**settings.REDIS)
+        self.redis = get_redis()
         self.interval_key = '{}-updated'
+        self.chunk_size = settings.POSTS_BULK_CHUNK_SIZE
+        self.page_size = 50
+        self.pages_in_flight = settings.POSTS_PAGES_IN_FLIGHT
+        self.fetch_concurrency = settings.POSTS_FETCH_CONCURRENCY
+        self.full_update_interval = settings.POSTS_FULL_UPDATE_INTERVAL
+        self.update_chunk_size = settings.POSTS_UPDATE_CHUNK_SIZE
+        self.chunks_key = 'update-chunks-{}'
+        self.chunks_failed_key = 'update-chunks-failed-{}'
+        self.fetch_retries = settings.TUMBLR_FETCH_RETRIES
+        self.fetch_backoff = settings.TUMBLR_FETCH_BACKOFF
+        self.update_fields = [
+            'blog', 'post_url', 'date', 'is_reblog', 'summary',
+            'slug', 'note_count', 'title', 'timestamp', 'mobile',
+        ]
 
-    def _retrieve_posts(self, blog_name) -> list:
+    def _fetch_page(self, blog_name, offset: int) -> List[dict]:
         """
-        Get all posts from blog by it's name
+        Get single page of posts
 
         :param blog_name: blog name
+        :param offset: offset of the first post on the page
         :return: list of posts
         """
-        posts = []
-        offset = 0
-        limit = 50
+        for attempt in itertools.count():
+            try:
+                payload = self.client.posts(blog_name, limit=self.page_size, offset=offset, reblog_info=True)
+            except RequestException as e:
+                error = TransientTumblrError(f'Failed to get posts of {blog_name} at {offset}: {e}')
+            else:
+                if 'posts' in payload:
+                    return payload['posts']
+                # PyTumblr doesn't raise on HTTP errors, it returns response metadata instead
+                status = payload.get('meta', {}).get('status', 0)
+                message = f'Tumblr responded with {status} to posts of {blog_name} at {offset}'
+                if status < 500:
+                    raise TumblrError(message)
+                error = TransientTumblrError(message)
+            if attempt >= self.fetch_retries:
+                raise error
+            time.sleep(self.fetch_backoff * 2 ** attempt)
+
+    def _retrieve_posts(self, blog_name, offset: int = 0) -> Iterator[List[dict]]:
+        """
+        Get all posts from blog by it's name. Posts are fetched lazily page by page
+
+        :param blog_name: blog name
+        :param offset: offset to start from
+        :return: iterator over pages of posts
+        """
         while True:
-            payload = self.client.posts(blog_name, limit=limit, offset=offset, reblog_info=True)
-            posts += payload['posts']
-            if not payload['posts']:
+            posts = self._fetch_page(blog_name, offset)
+            if not posts:
                 break
-            offset += limit
-        return posts
+            yield posts
+            offset += self.page_size
+
+    def _retrieve_posts_concurrently(self, blog_name, total: int, start: int = 0,
+                                     stop: Optional[int] = None) -> Iterator[List[dict]]:
+        """
+        Get all posts from blog fetching pages concurrently. Page offsets are computed from
+        the known posts count, pages are yielded in order. At most POSTS_PAGES_IN_FLIGHT pages
+        are fetched ahead of the consumer. If the blog turns out to have more posts than
+        expected, the rest is fetched sequentially
+
+        :param blog_name: blog name
+        :param total: expected posts count
+        :param start: offset to start from
+        :param stop: offset to stop at, None to fetch all posts after start
+        :return: iterator over pages of posts
+        """
+        offsets = iter(range(start, total if stop is None else stop, self.page_size))
+        window = max(self.pages_in_flight, self.fetch_concurrency)
+        fetch_page = bind(self._fetch_page)
+        next_offset = start
+        with ThreadPoolExecutor(max_workers=self.fetch_concurrency) as executor:
+            futures = deque(
+                executor.submit(fetch_page, blog_name, offset)
+                for offset in itertools.islice(offsets, window)
+            )
+            try:
+                while futures:
+                    posts = futures.popleft().result()
+                    if not posts:
+                        return
+                    offset = next(offsets, None)
+                    if offset is not None:
+                        futures.append(executor.submit(fetch_page, blog_name, offset))
+                    next_offset += self.page_size
+                    yield posts
+            finally:
+                for future in futures:
+                    future.cancel()
+        if stop is None:
+            yield from self._retrieve_posts(blog_name, offset=next_offset)
 
     def check_update_interval(self, blog_name):
         """
@@ -54,38 +175,412 @@ class PostsService:
         ttl = self.redis.ttl(self.interval_key.format(blog_name))
         return ttl if ttl > 0 else None
 
-    def update_posts(self, user: user_model, blog_name: Optional[str] = None) -> None:
+    @staticmethod
+    def _parse_post(post: dict, blog: Blog) -> Post:
+        """
+        Build (unsaved) Post object from Tumblr API post payload
+
+        :param post: post payload
+        :param blog: Blog object the post belongs to
+        :return: Post object
+        """
+        post_object = Post(
+            id=post['id'],
+            blog=blog,
+            post_url=post['post_url'],
+            date=datetime.datetime.strptime(post['date'], '%Y-%m-%d %H:%M:%S GMT'),
+            is_reblog='reblogged_from_id' in post,
+            summary=post['summary'] or '',
+            slug=post['slug'] or '',
+            note_count=post['note_count'],
+            title=post.get('title') or '',
+            timestamp=post['timestamp'],
+            mobile=post.get('mobile', False),
+        )
+        post_object.normalize()
+        post_object.fingerprint = PostsService._get_fingerprint(post_object, post['tags'])
+        return post_object
+
+    @staticmethod
+    def _get_fingerprint(post: Post, tags: List[str]) -> int:
+        """
+        Compute hash of the fields of the post which are stored, including its tags
+
+        :param post: Post object
+        :param tags: tag names
+        :return: 64-bit signed integer
+        """
+        fields = [post.post_url, post.date, post.is_reblog, post.summary, post.slug,
+                  post.note_count, post.title, post.timestamp, post.mobile] + sorted(set(tags))
+        digest = hashlib.blake2b('\x1f'.join(map(str, fields)).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big', signed=True)
+
+    @staticmethod
+    def _get_or_create_tags(names: Set[str]) -> Dict[str, int]:
+        """
+        Resolve tag names to tag ids, creating missing tags
+
+        :param names: tag names
+        :return: mapping of tag name to tag id
+        """
+        tags = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+        missing = names - tags.keys()
+        if missing:
+            Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+            tags.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+        return tags
+
+    @staticmethod
+    def _get_stored_posts(post_ids) -> Dict[int, Tuple[int, str]]:
+        """
+        Get note counts and fingerprints of posts which are saved already
+
+        :param post_ids: ids of posts
+        :return: mapping of id of stored post to its note count and fingerprint
+        """
+        return {
+            post_id: (note_count, fingerprint)
+            for post_id, note_count, fingerprint in Post.objects.filter(id__in=post_ids).values_list(
+                'id', 'note_count', 'fingerprint',
+            )
+        }
+
+    def _save_posts_chunk(self, blog: Blog, posts: List[dict]) -> IngestChanges:
+        """
+        Insert or update chunk of posts with their tags using a constant number of queries.
+        Posts which fingerprints haven't changed are not written at all, only added
+        and removed tags of changed posts are written.
+        Parts of a chunked update may fetch the same posts, as offsets shift when new posts appear,
+        so posts inserted by another update in the meantime are updated instead
+
+        :param blog: Blog object
+        :param posts: posts payloads
+        :return: changes made
+        """
+        posts = {post['id']: post for post in posts}
+        post_objects = [self._parse_post(post, blog) for post in posts.values()]
+        existing = self._get_stored_posts(posts.keys())
+        new = [p for p in post_objects if p.id not in existing]
+        if new:
+            Post.objects.bulk_create(new, ignore_conflicts=True)
+            # Rows which differ from ours were inserted by another update, those with equal data are taken as ours
+            fingerprints = {p.id: p.fingerprint for p in new}
+            concurrent = {post_id: stored for post_id, stored in self._get_stored_posts(fingerprints.keys()).items()
+                          if stored[1] != fingerprints[post_id]}
+            existing.update(concurrent)
+            new = [p for p in new if p.id not in concurrent]
+        changed = [p for p in post_objects if p.id in existing and existing[p.id][1] != p.fingerprint]
+        changes = IngestChanges()
+        if not new and not changed:
+            return changes
+        Post.objects.bulk_update(changed, fields=self.update_fields + ['fingerprint'])
+        changes.note_counts = {p.id: p.note_count for p in new + changed
+                               if p.id not in existing or existing[p.id][0] != p.note_count}
+
+        written = [posts[p.id] for p in new + changed]
+        tags = self._get_or_create_tags({tag for post in written for tag in post['tags']})
+        through = Post.tags.through
+        # Tags of new posts may have been linked by another update too
+        old_rows = through.objects.filter(post_id__in=[p.id for p in new + changed]).values_list(
+            'id', 'post_id', 'tag_id')
+        old_links = {(post_id, tag_id): row_id for row_id, post_id, tag_id in old_rows}
+        links = {(post['id'], tags[name]) for post in written for name in post['tags']}
+        removed = [row_id for link, row_id in old_links.items() if link not in links]
+        if removed:
+            through.objects.filter(id__in=removed).delete()
+        through.objects.bulk_create([
+            through(post_id=post_id, tag_id=tag_id) for post_id, tag_id in links - old_links.keys()
+        ], ignore_conflicts=True)
+        # Statistics of the tags of written posts change along with their note counts
+        changes.tags = {tag_id for _, tag_id in old_links} | set(tags.values())
+        return changes
+
+    def _save_posts(self, blog: Blog, posts: List[dict]) -> IngestChanges:
+        """
+        Save posts to database. Posts are written in chunks, each chunk in its own transaction
+
+        :param blog: Blog object
+        :param posts: posts payloads
+        :return: changes made
+        """
+        changes = IngestChanges()
+        for start in range(0, len(posts), self.chunk_size):
+            with transaction.atomic():
+                changes.update(self._save_posts_chunk(blog, posts[start:start + self.chunk_size]))
+        return changes
+
+    def is_full_update_needed(self, blog: Blog) -> bool:
+        """
+        Check whether all posts of the blog should be re-fetched instead of only new ones.
+        Full update is needed to refresh note counts of old posts, so it's done periodically
+
+        :param blog: Blog object
+        :return: True if full update is needed
+        """
+        if blog.last_post_id is None or blog.last_full_update is None:
+            return True
+        return timezone.now() - blog.last_full_update > datetime.timedelta(seconds=self.full_update_interval)
+
+    @staticmethod
+    def _is_known(post: dict, blog: Blog) -> bool:
+        """
+        Check whether post is not newer than the newest post seen during previous updates
+        """
+        return blog.last_post_id is not None and post['id'] <= blog.last_post_id
+
+    def _ingest(self, blog: Blog, full: bool, start: int = 0, stop: Optional[int] = None,
+                report_progress: bool = False) -> IngestChanges:
+        """
+        Fetch posts from Tumblr and save them. Incremental (not full) ingest stops
+        as soon as already known post is met, as posts are returned newest first
+
+        :param blog: Blog object
+        :param full: re-fetch all posts instead of only new ones
+        :param start: offset to start full ingest from
+        :param stop: offset to stop full ingest at, None to fetch all posts after start
+        :param report_progress: publish progress of the update with ProgressService
+        :return: changes made
+        """
+        newest = None
+        changes = IngestChanges()
+        offset = start
+        if full:
+            offset = self._get_checkpoint(blog, start) or start
+            pages = self._retrieve_posts_concurrently(blog.blog_name, blog.posts, offset, stop)
+        else:
+            # Incremental ingest usually needs a single page, so fetching ahead would only waste API calls
+            pages = self._retrieve_posts(blog.blog_name)
+        with closing(pages):
+            for posts in pages:
+                reached_known = False
+                if not full:
+                    # Pinned posts are shown first regardless of their age, so they don't stop the ingest
+                    reached_known = any(self._is_known(p, blog) and not p.get('is_pinned') for p in posts)
+                    posts = [p for p in posts if not self._is_known(p, blog)]
+                if full:
+                    offset += self.page_size
+                    # Checkpoint is saved along with the page, so an interrupted update resumes right after it
+                    with transaction.atomic():
+                        changes.update(self._save_posts(blog, posts))
+                        self._save_checkpoint(blog, start, offset)
+                else:
+                    changes.update(self._save_posts(blog, posts))
+                if report_progress:
+                    ProgressService().add_page(blog.blog_name, len(posts))
+                for post in posts:
+                    if newest is None or post['id'] > newest['id']:
+                        newest = post
+                if reached_known:
+                    break
+
+        if newest is not None:
+            self._save_newest_post(blog, newest)
+        if full:
+            UpdateCheckpoint.objects.filter(blog=blog, start=start).delete()
+        if full and start == 0 and stop is None:
+            blog.last_full_update = timezone.now()
+            blog.save(update_fields=['last_full_update', 'updated'])
+        return changes
+
+    @staticmethod
+    def _save_newest_post(blog: Blog, post: dict) -> None:
+        """
+        Remember the newest post seen, unless a newer one is already known
+
+        :param blog: Blog object
+        :param post: payload of the newest post of the ingest
+        """
+        # Parts of a chunked update run concurrently, so the newest post is only ever moved forward
+        Blog.objects.filter(
+            Q(last_post_id__isnull=True) | Q(last_post_id__lt=post['id']), pk=blog.pk,
+        ).update(last_post_id=post['id'], last_post_timestamp=post['timestamp'])
+        blog.refresh_from_db(fields=['last_post_id', 'last_post_timestamp'])
+
+    def _get_checkpoint(self, blog: Blog, start: int) -> Optional[int]:
+        """
+        Get offset to resume interrupted full update from
+
+        :param blog: Blog object
+        :param start: offset of the first post of the update part
+        :return: offset or None if the part wasn't started yet
+        """
+        checkpoint = UpdateCheckpoint.objects.filter(blog=blog, start=start).first()
+        if checkpoint is None:
+            return None
+        # Posts published since the checkpoint shift older posts to bigger offsets
+        return max(start, checkpoint.offset + blog.posts - checkpoint.posts)
+
+    def _save_checkpoint(self, blog: Blog, start: int, offset: int) -> None:
+        """
+        Remember progress of full update
+
+        :param blog: Blog object
+        :param start: offset of the first post of the update part
+        :param offset: offset of the next page to fetch
+        """
+        UpdateCheckpoint.objects.update_or_create(blog=blog, start=start,
+                                                  defaults={'offset': offset, 'posts': blog.posts})
+
+    def _finish_update(self, blog: Blog, changes: IngestChanges, full: bool) -> None:
+        """
+        Update data derived from posts once they are saved
+
+        :param blog: Blog object
+        :param changes: changes made by ingest
+        :param full: whether all posts were updated
+        """
+        StatsService().refresh_stats(blog)
+        if full:
+            TagStatsService().refresh_blog(blog)
+        else:
+            TagStatsService().refresh_tags(blog, changes.tags)
+        SnapshotService().record(blog, changes.note_counts)
+        ResponseCache().bump_version(blog.blog_name)
+
+    def update_posts(self, user: user_model, blog_name: Optional[str] = None, full: Optional[bool] = None,
+                     set_interval: bool = True) -> None:
         """
         Update posts for specific blog
 
         :param user: User object
         :param blog_name: blog name
+        :param full: re-fetch all posts (True) or only new ones (False).
+            By default full update is done once per POSTS_FULL_UPDATE_INTERVAL
+        :param set_interval: make user wait MIN_POSTS_UPDATE_INTERVAL before requesting the next update.
+            Scheduled updates don't, as the user hasn't requested them
+        """
+        blog = BlogsService().get_user_blog(user, blog_name, fetch_missing=True)
+        if set_interval:
+            self.redis.set(self.interval_key.format(blog.blog_name), 1, ex=self.interval)
+        if full is None:
+            full = self.is_full_update_needed(blog)
+        # Incremental update is expected to fetch the posts published since the last update
+        total = blog.posts if full else blog.posts - Post.objects.filter(blog=blog).count()
+        progress = ProgressService()
+        progress.start(blog.blog_name, total, full)
+        changes = self._ingest(blog, full, report_progress=True)
+        self._finish_update(blog, changes, full)
+        progress.finish(blog.blog_name)
+
+    def reset_update_interval(self, blog_name: str) -> None:
+        """
+        Allow updating the blog again right away, e.g. after failed update
+
+        :param blog_name: blog name
+        """
+        self.redis.delete(self.interval_key.format(blog_name))
+
+    def get_update_chunks(self, blog: Blog) -> List[Tuple[int, Optional[int]]]:
+        """
+        Split full update of the blog into parts of POSTS_UPDATE_CHUNK_SIZE posts
+        which can be run as separate jobs
+
+        :param blog: Blog object
+        :return: list of (start, stop) offsets, stop of the last part is None
+        """
+        starts = list(range(0, blog.posts, self.update_chunk_size)) or [0]
+        return [(start, start + self.update_chunk_size) for start in starts[:-1]] + [(starts[-1], None)]
+
+    def start_chunked_update(self, blog: Blog, chunks_count: int, set_interval: bool = True) -> bool:
+        """
+        Prepare full update split into parts. Every part should then be run with update_posts_chunk
+
+        :param blog: Blog object
+        :param chunks_count: count of parts
+        :param set_interval: make user wait MIN_POSTS_UPDATE_INTERVAL before requesting the next update
+        :return: False if parts of the previous update are still running, so the update isn't started
+        """
+        if not self.redis.set(self.chunks_key.format(blog.pk), chunks_count, nx=True, ex=self.full_update_interval):
+            return False
+        if set_interval:
+            self.redis.set(self.interval_key.format(blog.blog_name), 1, ex=self.interval)
+        self.redis.delete(self.chunks_failed_key.format(blog.pk))
+        ProgressService().start(blog.blog_name, blog.posts, full=True)
+        return True
+
+    def update_posts_chunk(self, user: user_model, blog_name: str, start: int, stop: Optional[int]) -> None:
+        """
+        Run a part of full update prepared with start_chunked_update.
+        Data derived from posts is updated once the last part is finished
+
+        :param user: User object
+        :param blog_name: blog name
+        :param start: offset of the first post of the part
+        :param stop: offset to stop at, None for the last part
         """
-        self.redis.set(self.interval_key.format(blog_name), 1, ex=self.interval)
         blog = BlogsService().get_user_blog(user, blog_name)
-        posts = self._retrieve_posts(blog_name)
-
-        for post in posts:
-            tags = []
-            for tag in post['tags']:
-                tag_object, created = Tag.objects.get_or_create(name=tag)
-                tags.append(tag_object)
-            post_object, created = Post.objects.update_or_create(
-                id=post['id'],
-                defaults={
-                    'blog': blog,
-                    'post_url': post['post_url'],
-                    'date': datetime.datetime.strptime(post['date'], '%Y-%m-%d %H:%M:%S GMT'),
-                    'is_reblog': 'reblogged_from_id' in post,
-                    'summary': post['summary'] or '',
-                    'slug': post['slug'] or '',
-                    'note_count': post['note_count'],
-                    'title': post.get('title') or '',
-                    'timestamp': post['timestamp'],
-                    'mobile': post.get('mobile', False),
-                }
-            )
-            post_object.tags.set(tags)
+        changes = self._ingest(blog, True, start, stop, report_progress=True)
+        SnapshotService().record_posts(changes.note_counts)
+        self._finish_chunk(blog)
+
+    def drop_posts_chunk(self, user: user_model, blog_name: str) -> None:
+        """
+        Give up a part of full update which has failed and won't be retried.
+        The update is reported as failed, but data derived from posts is still updated
+        once the last part is finished, as other parts may have saved posts
+
+        :param user: User object
+        :param blog_name: blog name
+        """
+        self.reset_update_interval(blog_name)
+        ProgressService().fail(blog_name)
+        try:
+            blog = BlogsService().get_user_blog(user, blog_name)
+        except Blog.DoesNotExist:
+            return
+        self.redis.set(self.chunks_failed_key.format(blog.pk), 1, ex=self.full_update_interval)
+        self._finish_chunk(blog)
+
+    def _finish_chunk(self, blog: Blog) -> None:
+        """
+        Count a part of full update as finished, and finish the update if it was the last part
+
+        :param blog: Blog object
+        """
+        if self.redis.decr(self.chunks_key.format(blog.pk)) > 0:
+            return
+        self.redis.delete(self.chunks_key.format(blog.pk))
+        # Update with a dropped part is incomplete, so the next update is full again
+        failed = self.redis.delete(self.chunks_failed_key.format(blog.pk))
+        if not failed:
+            blog.last_full_update = timezone.now()
+            blog.save(update_fields=['last_full_update', 'updated'])
+        StatsService().refresh_stats(blog)
+        TagStatsService().refresh_blog(blog)
+        SnapshotService().record_blog(blog)
+        ResponseCache().bump_version(blog.blog_name)
+        if failed:
+            ProgressService().fail(blog.blog_name)
+        else:
+            ProgressService().finish(blog.blog_name)
+
+    def import_posts(self, blog: Blog, pages: Iterable[List[dict]]) -> int:
+        """
+        Save posts got from elsewhere than Tumblr API, e.g. read from a dump, and update data derived from them.
+        Pages are saved one by one, so they can be produced lazily
+
+        :param blog: Blog object
+        :param pages: iterable over lists of posts payloads, as returned by Tumblr API
+        :return: count of imported posts
+        """
+        snapshots = SnapshotService()
+        newest = None
+        count = 0
+        for posts in pages:
+            changes = self._save_posts(blog, posts)
+            # Note counts are recorded right away, as a dump can hold too many posts to keep their changes
+            snapshots.record_posts(changes.note_counts)
+            for post in posts:
+                if newest is None or post['id'] > newest['id']:
+                    newest = post
+            count += len(posts)
+        if newest is not None:
+            self._save_newest_post(blog, newest)
+        StatsService().refresh_stats(blog)
+        TagStatsService().refresh_blog(blog)
+        snapshots.record_blog(blog)
+        ResponseCache().bump_version(blog.blog_name)
+        return count
 
     def get_top_posts(self, user: user_model, blog_name: Optional[str] = None, count=5, exclude_reblogs=True) -> list:
         """
@@ -98,17 +593,9 @@ class PostsService:
         :return: posts top list
         """
         blog = BlogsService().get_user_blog(user, blog_name)
-        posts = Post.objects.filter(blog=blog).order_by('-note_count')
-        if exclude_reblogs:
-            posts = posts.filter(is_reblog=False)
-        result = []
-        for post in posts[:count]:
-            result.append({
-                'title': str(post),
-                'note_count': post.note_count,
-                'url': post.post_url,
-            })
-        return result
+        stats = StatsService().get_stats(blog)
+        posts = json.loads(stats.top_posts if exclude_reblogs else stats.top_posts_with_reblogs)
+        return posts[:count]
 
     def get_notes_stats(self, user: user_model, blog_name: Optional[str] = None, exclude_reblogs=True) -> List[int]:
         """
@@ -119,11 +606,28 @@ class PostsService:
         :param exclude_reblogs: exclude reblogs (useful because reblogged posts often have too much likes)
         :return:
         """
-        blog = BlogsService.get_user_blog(user, blog_name)
-        posts = Post.objects.filter(blog=blog).order_by('timestamp').values_list('note_count', flat=True)
-        if exclude_reblogs:
-            posts.filter(is_reblog=False)
-        return [i for i in posts]
+        blog = BlogsService().get_user_blog(user, blog_name)
+        stats = StatsService().get_stats(blog)
+        return json.loads(stats.notes if exclude_reblogs else stats.notes_with_reblogs)
+
+    def get_notes_graph(self, user: user_model, blog_name: Optional[str] = None, points: Optional[int] = None,
+                        since: Optional[int] = None, until: Optional[int] = None,
+                        exclude_reblogs=True) -> List[dict]:
+        """
+        Get notes graph downsampled to a bounded count of points. Useful for drawing a graph
+        of notes for blogs with a lot of posts
+
+        :param user: User object
+        :param blog_name: blog name
+        :param points: maximum count of points, defaults to NOTE_GRAPH_MAX_POINTS
+        :param since: start of time range (unix timestamp)
+        :param until: end of time range (unix timestamp)
+        :param exclude_reblogs: exclude reblogs (useful because reblogged posts often have too much likes)
+        :return: list of points with time, posts count and min, max and mean notes
+        """
+        blog = BlogsService().get_user_blog(user, blog_name)
+        return StatsService().compute_notes_buckets(blog, points or settings.NOTE_GRAPH_MAX_POINTS,
+                                                    since, until, exclude_reblogs)
 
 
 class BlogsService:
@@ -131,40 +635,123 @@ class BlogsService:
     Blogs service which is responsible for getting info about Tumblr blogs
     """
     def __init__(self):
-        self.api_key = settings.TUMBLR_CONSUMER_KEY
-        self.client = pytumblr.TumblrRestClient(self.api_key)
+        self.client = AuthService.get_api_client()
         self.interval = settings.MIN_POSTS_UPDATE_INTERVAL
-        self.redis = Redis(**settings.REDIS)
+        self.redis = get_redis()
         self.interval_key = '{}-updated'
+        self.cache = ResponseCache()
+        self.cache_ttl = settings.BLOG_CACHE_TTL
 
-    def get_user_blog(self, user: user_model, blog_name: Optional[str] = None) -> dict:
+    def get_user_blog(self, user: user_model, blog_name: Optional[str] = None, fetch_missing: bool = False) -> Blog:
         """
         Get blog by it's name. This method should be used everywhere instead of getting directly
-        from database, as this method automatically gets blogs info from tumblr if it's not present
-        in database yet
+        from database, as this method memoizes blogs and can get blogs info from tumblr if it's not present
+        in database yet.
+        Blogs are memoized for the request and for BLOG_CACHE_TTL by the process. Blog data version
+        is checked before using the latter, so blogs are re-read once their data is changed by an update
+
+        Only blogs owned or watched by the user are returned, Blog.DoesNotExist is raised for others.
 
+        :param user: User object
         :param blog_name: blog name or None if primary blog needed
+        :param fetch_missing: fetch blogs info from Tumblr if the blog isn't known (at most once per
+            update interval). Read API doesn't do it, blogs are fetched on login and by update jobs
         :return: Blog object
         """
         if blog_name is None:
             blog_name = user.username
-        try:
-            blog = Blog.objects.get(blog_name=blog_name)
-        except Blog.DoesNotExist:
-            self.update_user_info(user)
-            blog = Blog.objects.get(blog_name=blog_name)
+        key = (user.pk, blog_name)
+        blog = get_scoped(('blog',) + key)
+        if blog is not None:
+            return blog
+        version = self.cache.get_version(blog_name)
+        cached = _blogs.get(key)
+        if cached is not None and cached[0] == version:
+            # Instances are copied, so callers changing them don't affect each other
+            blog = copy.copy(cached[1])
+        else:
+            try:
+                blog = self.get_user_blogs(user).get(blog_name=blog_name)
+            except Blog.DoesNotExist:
+                # Blogs info is re-fetched at most once per update interval, as the blog may not exist at all
+                if not fetch_missing or self.redis.exists(self.interval_key.format(user.username)):
+                    raise
+                self.update_user_info(user)
+                blog = self.get_user_blogs(user).get(blog_name=blog_name)
+                version = self.cache.get_version(blog_name)
+            _blogs.set(key, (version, copy.copy(blog)), self.cache_ttl)
+        set_scoped(('blog',) + key, blog)
         return blog
 
+    def invalidate_blog(self, user: user_model, blog_name: str) -> None:
+        """
+        Drop memoized blog of the user. Memoized blogs of other processes are dropped by bumping
+        blog data version, which is done when posts or blogs info are updated
+
+        :param user: User object
+        :param blog_name: blog name
+        """
+        _blogs.delete((user.pk, blog_name))
+        discard_scoped(('blog', user.pk, blog_name))
+
+    def get_user_blogs(self, user: user_model):
+        """
+        Get blogs owned or watched by the user
+
+        :param user: User object
+        :return: queryset of Blog objects
+        """
+        return Blog.objects.filter(Q(user=user) | Q(watchers=user)).distinct()
+
+    def watch_blog(self, user: user_model, blog_name: str) -> Optional[Blog]:
+        """
+        Start tracking statistics of a public blog not owned by the user
 
-    def update_user_info(self, user: user_model) -> None:
+        :param user: User object
+        :param blog_name: blog name
+        :return: Blog object or None if there's no such blog
+        """
+        payload = self.client.blog_info(blog_name)
+        if 'blog' not in payload:
+            return None
+        info = payload['blog']
+        blog, created = Blog.objects.get_or_create(
+            uuid=info['uuid'],
+            defaults=dict(
+                blog_name=info['name'],
+                title=info['title'],
+                avatar=f'https://api.tumblr.com/v2/blog/{info["name"]}/avatar',
+                is_primary=False,
+                posts=info['posts'],
+                followers=0,  # followers of other users' blogs are not available
+            ),
+        )
+        if not created:
+            Blog.objects.filter(pk=blog.pk).update(blog_name=info['name'], title=info['title'], posts=info['posts'])
+            blog.refresh_from_db()
+        if blog.user_id != user.pk:
+            blog.watchers.add(user)
+        self.invalidate_blog(user, blog.blog_name)
+        return blog
+
+    def update_user_info(self, user: user_model, set_interval: bool = True) -> None:
         """
         Update user info from Tumblr
 
         :param user: User object
+        :param set_interval: make user wait MIN_POSTS_UPDATE_INTERVAL before requesting the next update
+        """
+        if set_interval:
+            self.redis.set(self.interval_key.format(user.username), 1, ex=self.interval)
+        self.save_user_info(user, AuthService().get_user_info(user))
+
+    def save_user_info(self, user: user_model, info: dict) -> None:
+        """
+        Save blogs of the user from user info got from Tumblr
+
+        :param user: User object
+        :param info: user info returned by AuthService
         """
-        blog_name = user.username
-        self.redis.set(self.interval_key.format(blog_name), 1, ex=self.interval)
-        info = AuthService().get_user_info(user)
         primary_blog = None
         for blog in info['blogs']:
             Blog.objects.update_or_create(
@@ -183,3 +770,6 @@ class BlogsService:
                 primary_blog = blog
         user.username = primary_blog['name']
         user.save()
+        for blog in info['blogs']:
+            self.cache.bump_version(blog['name'])
+            self.invalidate_blog(user, blog['name'])
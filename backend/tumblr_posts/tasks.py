@@ -1,23 +1,269 @@
+from typing import Optional, Sequence
 import dramatiq
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from dramatiq.middleware import CurrentMessage, TimeLimitExceeded
 from dramatiq.rate_limits.backends import RedisBackend
 from dramatiq.rate_limits import ConcurrentRateLimiter
-from tumblr_posts.services.tumblr import PostsService, BlogsService
+from backend.clients import get_redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from django.db import InterfaceError, OperationalError
+from tumblr_auth.exceptions import RateLimitExceeded
+from tumblr_posts.models import Blog
+from tumblr_posts.services.progress import ProgressService
+from tumblr_posts.services.tumblr import PostsService, BlogsService, TransientTumblrError
 
+# Interactive queue is for updates users are waiting for, background queue is for everything else.
+# Lower priority number means the message is processed first
+INTERACTIVE_QUEUE = 'interactive'
+BACKGROUND_QUEUE = 'background'
+QUEUED_KEY = 'update-queued-{}'
+# Scheduled updates are deduplicated separately, so they don't block updates requested by user
+SCHEDULED_KEY = 'update-scheduled-{}'
+# Errors which are likely gone by the next attempt. Interrupted full updates resume from checkpoint
+TRANSIENT_ERRORS = (TransientTumblrError, RedisConnectionError, OperationalError, InterfaceError, TimeLimitExceeded)
+UPDATE_OPTIONS = {
+    'min_backoff': settings.UPDATE_MIN_BACKOFF,
+    'max_backoff': settings.UPDATE_MAX_BACKOFF,
+    'time_limit': settings.UPDATE_TIME_LIMIT,
+}
 
-@dramatiq.actor
-def update_posts_and_blog_info(user_id: int):
+
+def _should_retry(retries: int, exception: Exception) -> bool:
+    """
+    Retry only jobs failed because of temporary errors, others would fail again.
+    Chunks waiting for a free slot of user's concurrency limit are retried longer
+
+    :param retries: count of retries done
+    :param exception: error the job failed with
+    :return: True if the job should be retried
+    """
+    if isinstance(exception, dramatiq.RateLimitExceeded):
+        return retries < settings.UPDATE_MAX_RETRIES * 4
+    return retries < settings.UPDATE_MAX_RETRIES and isinstance(exception, TRANSIENT_ERRORS)
+
+
+def _will_retry(exception: Exception) -> bool:
+    """
+    Check whether the job being run will be retried after failing with the exception
+
+    :param exception: error the job is failing with
+    :return: False if the job is run by a worker and it's the last attempt, or if it's not run by a worker
+    """
+    message = CurrentMessage.get_current_message()
+    return message is not None and _should_retry(message.options.get('retries', 0), exception)
+
+
+def enqueue_update(actor, user_id: int, all_blogs: bool = False, public_blogs: Sequence[str] = ()) -> bool:
     """
-    Task for asynchronous updating posts and blog information
+    Enqueue posts update unless an update for the user is already waiting in a queue,
+    so a single user can't occupy workers with repeated requests
 
+    :param actor: one of update actors
     :param user_id: user id in django
+    :param all_blogs: update all blogs of the user instead of only the primary one
+    :param public_blogs: names of public blogs to start watching and update
+    :return: True if update was enqueued
     """
-    user = get_user_model().objects.get(id=user_id)
-    blog_name = user.username
-    mutex = ConcurrentRateLimiter(RedisBackend(**settings.REDIS), f"mutex-blog-{blog_name}", limit=1)
+    redis = get_redis()
+    if not redis.set(QUEUED_KEY.format(user_id), actor.actor_name, nx=True, ex=settings.MIN_POSTS_UPDATE_INTERVAL):
+        return False
+    actor.send(user_id, all_blogs, list(public_blogs))
+    return True
+
+
+def enqueue_scheduled_update(blog: Blog) -> bool:
+    """
+    Enqueue periodic update of the blog unless the previous one is still waiting in a queue.
+    Primary blog is updated along with information of its user. Public blogs
+    are updated with API access of one of users watching them
+
+    :param blog: Blog object
+    :return: True if update was enqueued
+    """
+    user_id = blog.user_id or blog.watchers.values_list('id', flat=True).first()
+    if user_id is None:
+        return False
+    if not get_redis().set(SCHEDULED_KEY.format(blog.blog_name), 1, nx=True, ex=settings.MIN_POSTS_UPDATE_INTERVAL):
+        return False
+    if blog.is_primary:
+        scheduled_update.send(user_id)
+    else:
+        update_blog_posts.send(user_id, blog.blog_name, False)
+    return True
+
+
+def _user_limiter(user_id: int) -> ConcurrentRateLimiter:
+    """
+    Get limiter of background jobs of the user run at once, so a user with many
+    or big blogs can't occupy all workers
+
+    :param user_id: user id in django
+    :return: rate limiter
+    """
+    return ConcurrentRateLimiter(RedisBackend(client=get_redis()), f"chunks-user-{user_id}",
+                                 limit=settings.UPDATE_USER_CONCURRENCY)
+
+
+def _reset_update(blog_name: str):
+    """
+    Don't make user wait for the update interval to pass after update failed
+
+    :param blog_name: blog name
+    """
+    PostsService().reset_update_interval(blog_name)
+    ProgressService().fail(blog_name)
+
+
+def _update_blog(user, blog_name: str, manual: bool = True) -> bool:
+    """
+    Update posts of a single blog. Full updates of big blogs are split into parts
+    run as separate background jobs
+
+    :param user: User object
+    :param blog_name: blog name
+    :param manual: update is requested by user, so the next one can't be requested for MIN_POSTS_UPDATE_INTERVAL
+    :return: False if the blog is being updated already
+    """
+    mutex = ConcurrentRateLimiter(RedisBackend(client=get_redis()), f"mutex-blog-{blog_name}", limit=1)
     with mutex.acquire(raise_on_failure=False) as acquired:
         if not acquired:
             return False
-        BlogsService().update_user_info(user)
-        PostsService().update_posts(user)
\ No newline at end of file
+        service = PostsService()
+        blog = BlogsService().get_user_blog(user, blog_name, fetch_missing=True)
+        chunks = service.get_update_chunks(blog) if service.is_full_update_needed(blog) else []
+        if len(chunks) > 1:
+            if not service.start_chunked_update(blog, len(chunks), set_interval=manual):
+                return False
+            for start, stop in chunks:
+                update_posts_chunk.send(user.id, blog.blog_name, start, stop)
+        else:
+            service.update_posts(user, blog.blog_name, set_interval=manual)
+    return True
+
+
+def _update(actor, user_id: int, all_blogs: bool = False, public_blogs: Sequence[str] = (), manual: bool = True):
+    """
+    Update blog information and posts of the primary blog. Other blogs are updated by separate
+    jobs run in parallel, they share the application's Tumblr API quota. If the quota is exhausted,
+    the task is rescheduled to the time it's available again
+
+    :param actor: actor running the update, used for rescheduling
+    :param user_id: user id in django
+    :param all_blogs: update all blogs of the user instead of only the primary one
+    :param public_blogs: names of public blogs to start watching and update
+    :param manual: update is requested by user, not by scheduler
+    """
+    user = get_user_model().objects.get(id=user_id)
+    get_redis().delete(QUEUED_KEY.format(user_id) if manual else SCHEDULED_KEY.format(user.username))
+    service = BlogsService()
+    try:
+        service.update_user_info(user, set_interval=manual)
+        watched = [service.watch_blog(user, name) for name in public_blogs]
+        blog_names = {blog.blog_name for blog in watched if blog is not None}
+        if all_blogs:
+            blog_names.update(service.get_user_blogs(user).values_list('blog_name', flat=True))
+        blog_names.discard(user.username)
+    except RateLimitExceeded as e:
+        actor.send_with_options(args=(user_id, all_blogs, list(public_blogs)), delay=int(e.retry_after * 1000))
+        return
+    except Exception:
+        _reset_update(user.username)
+        raise
+    for blog_name in sorted(blog_names):
+        update_blog_posts.send(user_id, blog_name, manual)
+    try:
+        _update_blog(user, user.username, manual)
+    except RateLimitExceeded as e:
+        # Blog information and other blogs are updated already
+        update_blog_posts.send_with_options(args=(user_id, user.username, manual), delay=int(e.retry_after * 1000))
+    except Exception:
+        _reset_update(user.username)
+        raise
+
+
+@dramatiq.actor(queue_name=INTERACTIVE_QUEUE, priority=0, retry_when=_should_retry, **UPDATE_OPTIONS)
+def first_update(user_id: int, all_blogs: bool = False, public_blogs: Sequence[str] = ()):
+    """
+    Task for updating posts and blog information of just registered user
+
+    :param user_id: user id in django
+    :param all_blogs: update all blogs of the user instead of only the primary one
+    :param public_blogs: names of public blogs to start watching and update
+    """
+    return _update(first_update, user_id, all_blogs, public_blogs)
+
+
+@dramatiq.actor(queue_name=INTERACTIVE_QUEUE, priority=10, retry_when=_should_retry, **UPDATE_OPTIONS)
+def update_posts_and_blog_info(user_id: int, all_blogs: bool = False, public_blogs: Sequence[str] = ()):
+    """
+    Task for asynchronous updating posts and blog information requested by user
+
+    :param user_id: user id in django
+    :param all_blogs: update all blogs of the user instead of only the primary one
+    :param public_blogs: names of public blogs to start watching and update
+    """
+    return _update(update_posts_and_blog_info, user_id, all_blogs, public_blogs)
+
+
+@dramatiq.actor(queue_name=BACKGROUND_QUEUE, priority=100, retry_when=_should_retry, **UPDATE_OPTIONS)
+def scheduled_update(user_id: int, all_blogs: bool = False, public_blogs: Sequence[str] = ()):
+    """
+    Task for periodic updating posts and blog information
+
+    :param user_id: user id in django
+    :param all_blogs: update all blogs of the user instead of only the primary one
+    :param public_blogs: names of public blogs to start watching and update
+    """
+    return _update(scheduled_update, user_id, all_blogs, public_blogs, manual=False)
+
+
+@dramatiq.actor(queue_name=BACKGROUND_QUEUE, priority=50, retry_when=_should_retry, **UPDATE_OPTIONS)
+def update_blog_posts(user_id: int, blog_name: str, manual: bool = True):
+    """
+    Task for updating posts of a single blog of the user or of a watched public blog,
+    without updating blog information. Shares UPDATE_USER_CONCURRENCY limit with parts of chunked updates
+
+    :param user_id: user id in django
+    :param blog_name: blog name
+    :param manual: update is requested by user, not by scheduler
+    """
+    if not manual:
+        get_redis().delete(SCHEDULED_KEY.format(blog_name))
+    user = get_user_model().objects.get(id=user_id)
+    with _user_limiter(user_id).acquire():
+        try:
+            _update_blog(user, blog_name, manual)
+        except RateLimitExceeded as e:
+            update_blog_posts.send_with_options(args=(user_id, blog_name, manual), delay=int(e.retry_after * 1000))
+        except Exception:
+            _reset_update(blog_name)
+            raise
+
+
+@dramatiq.actor(queue_name=BACKGROUND_QUEUE, priority=50, retry_when=_should_retry, **UPDATE_OPTIONS)
+def update_posts_chunk(user_id: int, blog_name: str, start: int, stop: Optional[int]):
+    """
+    Task for updating a part of posts of a big blog. At most UPDATE_USER_CONCURRENCY
+    parts of the same user run at once, others are retried later.
+    Failed part is retried and resumes from the last saved page. If it fails for good,
+    the update is finished without it
+
+    :param user_id: user id in django
+    :param blog_name: blog name
+    :param start: offset of the first post of the part
+    :param stop: offset to stop at, None for the last part
+    """
+    user = get_user_model().objects.get(id=user_id)
+    try:
+        with _user_limiter(user_id).acquire():
+            try:
+                PostsService().update_posts_chunk(user, blog_name, start, stop)
+            except RateLimitExceeded as e:
+                update_posts_chunk.send_with_options(args=(user_id, blog_name, start, stop),
+                                                     delay=int(e.retry_after * 1000))
+    except Exception as e:
+        if not _will_retry(e):
+            # Otherwise the update would never be finished, as it waits for all parts
+            PostsService().drop_posts_chunk(user, blog_name)
+        raise
\ No newline at end of file
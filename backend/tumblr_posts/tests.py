@@ -1,10 +1,741 @@
+import asyncio
 import json
-from django.test import TestCase
+import os
+import tempfile
+from time import monotonic
+from unittest import mock, skipUnless
+import dramatiq
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import AsyncClient, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from dramatiq.middleware import TimeLimit
+from backend.cache import ResponseCache
+from backend.clients import close_async_http_client, get_http_session
+from backend.memo import request_scope, reset
+from backend.streaming import AsyncStreamingASGIHandler, AsyncStreamingHttpResponse, _receive
+from tumblr_auth.exceptions import RateLimitExceeded
+from tumblr_auth.models import TumblrCredentials
+from tumblr_auth.services import auth
+from tumblr_auth.services.ratelimit import RateLimitedClient, TumblrRateLimiter
+from tumblr_posts.fake_tumblr import FakeBlog, FakeTumblrServer
+from tumblr_posts.models import Blog, BlogStats, Post, Tag, UpdateCheckpoint
+from tumblr_posts.services.aggregation import AggregationService
+from tumblr_posts.services.dump import DumpReader
+from tumblr_posts.services.export import ExportService, pyarrow
+from tumblr_posts.services.progress import ProgressService
+from tumblr_posts.services.scheduler import SchedulerService
+from tumblr_posts.services.snapshots import SnapshotService
+from tumblr_posts.services.stats import StatsService
+from tumblr_posts.services.tags import TagStatsService
+from tumblr_posts.services.tumblr import BlogsService, PostsService, TransientTumblrError
+from tumblr_posts.tasks import (
+    _update, QUEUED_KEY, SCHEDULED_KEY, enqueue_scheduled_update, enqueue_update, scheduled_update, update_blog_posts,
+    update_posts_and_blog_info, update_posts_chunk,
+)
 
 
 class GetNoteStatistics(TestCase):
 
     def test_get_note_statistics(self):
-        response = self.client.get('/statistics/notes/')
-        payload = json.loads(response.body)
+        blog = make_blog(posts=4)
+        PostsService()._save_posts(blog, [make_post(i, note_count=i * 5) for i in range(4)])
+        StatsService().refresh_stats(blog)
+        self.client.force_login(blog.user)
+        response = self.client.get('/api/note_graph/')
+        payload = json.loads(response.content)
         self.assertEquals(payload, [0, 5, 10, 15])
+
+
+class Instrumentation(TestCase):
+
+    def setUp(self):
+        reset()
+        blog = make_blog()
+        StatsService().refresh_stats(blog)
+        ResponseCache().bump_version(blog.blog_name)
+        self.client.force_login(blog.user)
+
+    def test_instrumentation(self):
+        with self.settings(INSTRUMENTATION_HEADERS=True):
+            response = self.client.get('/api/top/')
+        self.assertGreater(int(response['X-SQL-Queries']), 0)
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('tumblrstats_request_seconds_count{method="GET",status="200",'
+                      'view="tumblr_posts.views.TopPostsView"}', metrics)
+
+
+class ResponseCaching(TestCase):
+
+    def setUp(self):
+        reset()
+        self.blog = make_blog()
+        ResponseCache().bump_version(self.blog.blog_name)
+        PostsService()._save_posts(self.blog, [make_post(1, note_count=5)])
+        StatsService().refresh_stats(self.blog)
+        self.client.force_login(self.blog.user)
+
+    def test_not_modified(self):
+        response = self.client.get('/api/top/')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/top/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get('/api/top/', HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_invalidation(self):
+        etag = self.client.get('/api/top/')['ETag']
+        PostsService()._save_posts(self.blog, [make_post(2, note_count=10)])
+        StatsService().refresh_stats(self.blog)
+        # Cached response is served until blog data version changes
+        response = self.client.get('/api/top/')
+        self.assertEqual(len(json.loads(response.content)), 1)
+        ResponseCache().bump_version(self.blog.blog_name)
+        response = self.client.get('/api/top/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)), 2)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class AsyncViews(TestCase):
+
+    def setUp(self):
+        reset()
+        user = get_user_model().objects.create(username='async')
+        TumblrCredentials.objects.create(user=user, token='token', secret='secret')
+        ResponseCache().bump_version(user.username)
+        self.async_client.force_login(user)
+
+    async def test_user_info(self):
+        with FakeTumblrServer([FakeBlog('async', 10)]) as server, \
+                self.settings(TUMBLR_API_HOST=server.url, TUMBLR_CONSUMER_KEY='key', TUMBLR_CONSUMER_SECRET='secret',
+                              TUMBLR_RATE_LIMITS={}, TUMBLR_USER_RATE_LIMITS={}, INSTRUMENTATION_HEADERS=True):
+            response = await self.async_client.get('/oauth/info/')
+            await close_async_http_client()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['blogs'][0]['posts'], 10)
+        self.assertEqual(response['X-Tumblr-Calls'], '1')
+
+    async def test_login_unavailable(self):
+        with FakeTumblrServer([FakeBlog('async', 10)]) as server, \
+                self.settings(TUMBLR_REQUEST_TOKEN_URL=server.url + '/oauth/request_token',
+                              TUMBLR_CONSUMER_KEY='key', TUMBLR_CONSUMER_SECRET='secret'):
+            response = await AsyncClient().get('/oauth/login/')
+            await close_async_http_client()
+        self.assertEqual(response.status_code, 503)
+
+    async def test_update_status(self):
+        await sync_to_async(ProgressService().queue)('async')
+        response = await self.async_client.get('/api/update_status/')
+        self.assertEqual(json.loads(response.content)['state'], ProgressService.QUEUED)
+
+
+class StreamingHandler(SimpleTestCase):
+
+    async def test_stream_disconnect(self):
+        sent = []
+        closed = asyncio.Event()
+        disconnected = asyncio.Event()
+
+        async def events():
+            try:
+                while True:
+                    yield 'data: \n\n'
+                    await asyncio.sleep(1)
+            finally:
+                closed.set()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            disconnected.set()
+
+        _receive.set(receive)
+        response = AsyncStreamingHttpResponse(events(), content_type='text/event-stream')
+        # Endless stream is stopped as soon as the client disconnects
+        await asyncio.wait_for(AsyncStreamingASGIHandler().send_response(response, send), timeout=5)
+        self.assertTrue(closed.is_set())
+        self.assertEqual([m['type'] for m in sent], ['http.response.start', 'http.response.body'])
+
+
+@override_settings(TUMBLR_RATE_LIMITS={'test': (2, 10)}, TUMBLR_USER_RATE_LIMITS={'test-user': (1, 10)})
+class RateLimits(SimpleTestCase):
+
+    def setUp(self):
+        self.limiter = TumblrRateLimiter()
+        for identity in ('token', 'other'):
+            self.limiter.redis.delete(*[key for key, _, _ in self.limiter._get_buckets(identity)])
+
+    def test_buckets(self):
+        with mock.patch('time.time', return_value=1000):
+            self.assertEqual(self.limiter.try_acquire(), 0)
+            self.assertEqual(self.limiter.try_acquire(), 0)
+            # A token is added every 5 seconds
+            self.assertEqual(self.limiter.try_acquire(), 5)
+            with self.assertRaises(RateLimitExceeded) as e:
+                self.limiter.acquire(max_wait=1)
+            self.assertEqual(e.exception.retry_after, 5)
+        with mock.patch('time.time', return_value=1005):
+            self.assertEqual(self.limiter.try_acquire('token'), 0)
+        with mock.patch('time.time', return_value=1010):
+            # User bucket is exhausted, though the consumer key one is not
+            self.assertEqual(self.limiter.try_acquire('token'), 5)
+            self.assertEqual(self.limiter.try_acquire('other'), 0)
+        self.assertFalse(any('token' in key for key, _, _ in self.limiter._get_buckets('token')))
+
+    def test_tumblr_rate_limit(self):
+        client = mock.Mock()
+        client.posts.return_value = {'meta': {'status': 429, 'msg': 'Limit Exceeded'}}
+        with self.assertRaises(RateLimitExceeded) as e:
+            RateLimitedClient(client, self.limiter, 'token').posts('test')
+        self.assertEqual(e.exception.retry_after, 60)
+
+
+class TumblrClients(SimpleTestCase):
+
+    def setUp(self):
+        auth._clients.clear()
+
+    def tearDown(self):
+        auth._clients.clear()
+
+    def test_clients_cache(self):
+        with self.settings(TUMBLR_CLIENTS_CACHE_SIZE=2):
+            first = auth._get_cached_client('first', 'secret')
+            second = auth._get_cached_client('second', 'secret')
+            self.assertIs(auth._get_cached_client('first', 'secret'), first)
+            # Least recently used client is dropped
+            auth._get_cached_client('third', 'secret')
+            self.assertIs(auth._get_cached_client('first', 'secret'), first)
+            self.assertIsNot(auth._get_cached_client('second', 'secret'), second)
+
+    def test_pooled_session(self):
+        response = mock.Mock()
+        response.json.return_value = {'meta': {'status': 200}, 'response': {'blog': {}}}
+        with mock.patch.object(get_http_session(), 'get', return_value=response) as get:
+            auth._get_cached_client('first', 'secret').client.blog_info('first')
+            auth._get_cached_client('second', 'secret').client.blog_info('second')
+        self.assertEqual(get.call_count, 2)
+
+
+def make_post(post_id, tags=(), note_count=0, **kwargs):
+    post = {
+        'id': post_id,
+        'post_url': f'https://test.tumblr.com/post/{post_id}/slug',
+        'date': '2020-05-01 12:00:00 GMT',
+        'summary': f'Post {post_id}',
+        'slug': 'slug',
+        'note_count': note_count,
+        'timestamp': 1588334400 + post_id,
+        'tags': list(tags),
+    }
+    post.update(kwargs)
+    return post
+
+
+def make_blog(blog_name='test', user=None, is_primary=True, **kwargs):
+    """
+    Create a blog without followers and posts. Primary blog gets a new user named after it,
+    unless the user is given
+    """
+    if user is None and is_primary:
+        user = get_user_model().objects.create(username=blog_name)
+    fields = {
+        'uuid': f't:{blog_name}',
+        'title': blog_name.capitalize(),
+        'avatar': f'https://{blog_name}.tumblr.com/avatar',
+        'followers': 0,
+        'posts': 0,
+    }
+    fields.update(kwargs)
+    return Blog.objects.create(user=user, blog_name=blog_name, is_primary=is_primary, **fields)
+
+
+class FakeTumblrClient:
+    """
+    Stand-in for pytumblr client serving posts from memory, newest first
+    """
+    def __init__(self, posts, failing_offsets=()):
+        self.posts_list = sorted(posts, key=lambda p: p['id'], reverse=True)
+        self.failing_offsets = set(failing_offsets)
+        self.offsets = []
+
+    def posts(self, blog_name, limit=20, offset=0, **kwargs):
+        self.offsets.append(offset)
+        if offset in self.failing_offsets:
+            return {'meta': {'status': 503, 'msg': 'Service Unavailable'}}
+        return {'posts': self.posts_list[offset:offset + limit]}
+
+
+class BulkSavePosts(TestCase):
+
+    def setUp(self):
+        self.blog = make_blog()
+        self.service = PostsService()
+
+    def test_save_posts(self):
+        self.service._save_posts(self.blog, [make_post(1, ['a', 'b']), make_post(2, ['b'])])
+        self.service._save_posts(self.blog, [make_post(2, ['c'], note_count=5), make_post(3)])
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertEqual(Tag.objects.count(), 3)
+        post = Post.objects.get(id=2)
+        self.assertEqual(post.note_count, 5)
+        self.assertEqual(post.get_tags(), 'c')
+        self.assertEqual(post.post_url, 'https://test.tumblr.com/post/2/')
+
+    def test_save_unchanged_posts(self):
+        posts = [make_post(i, ['a', f'tag{i}'], note_count=i) for i in range(1, 21)]
+        self.service._save_posts(self.blog, posts)
+        with CaptureQueriesContext(connection) as unchanged:
+            changes = self.service._save_posts(self.blog, posts)
+        writes = [q for q in unchanged.captured_queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(changes.note_counts, {})
+
+        posts[0] = make_post(1, ['b', 'tag1'], note_count=100)
+        changes = self.service._save_posts(self.blog, posts)
+        self.assertEqual(changes.note_counts, {1: 100})
+        self.assertCountEqual(Post.objects.get(id=1).tags.values_list('name', flat=True), ['b', 'tag1'])
+        self.assertEqual(changes.tags, set(Tag.objects.filter(name__in=['a', 'b', 'tag1']).values_list('id', flat=True)))
+
+    def test_save_posts_constant_queries(self):
+        with CaptureQueriesContext(connection) as small:
+            self.service._save_posts(self.blog, [make_post(i, [f'tag{i}']) for i in range(10)])
+        with CaptureQueriesContext(connection) as large:
+            self.service._save_posts(self.blog, [make_post(i, [f'tag{i}']) for i in range(10, 50)])
+        self.assertEqual(len(small), len(large))
+
+    def test_concurrently_inserted_posts(self):
+        self.service._save_posts(self.blog, [make_post(1, ['a', 'b'], note_count=5), make_post(2, ['c'], note_count=3)])
+        get_stored_posts = PostsService._get_stored_posts
+        reads = []
+
+        def read_before_insert(post_ids):
+            # Another part of the update inserts the posts after this one checked for them
+            reads.append(post_ids)
+            return {} if len(reads) == 1 else get_stored_posts(post_ids)
+
+        posts = [make_post(1, ['b', 'd'], note_count=10), make_post(2, ['c'], note_count=3), make_post(3)]
+        with mock.patch.object(PostsService, '_get_stored_posts', side_effect=read_before_insert):
+            changes = self.service._save_posts(self.blog, posts)
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertEqual(Post.objects.get(id=1).note_count, 10)
+        # Post saved with the same data can't be told from the one inserted by this update
+        self.assertEqual(changes.note_counts, {1: 10, 2: 3, 3: 0})
+        self.assertCountEqual(Post.objects.get(id=1).tags.values_list('name', flat=True), ['b', 'd'])
+        self.assertCountEqual(Post.objects.get(id=2).tags.values_list('name', flat=True), ['c'])
+
+    def test_incremental_ingest(self):
+        self.service.client = FakeTumblrClient([make_post(i) for i in range(1, 201)])
+        self.service._ingest(self.blog, full=True)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(self.blog.last_post_id, 200)
+        self.assertIsNotNone(self.blog.last_full_update)
+
+        self.service.client = FakeTumblrClient([make_post(i) for i in range(1, 211)])
+        self.service._ingest(self.blog, full=False)
+        self.assertEqual(Post.objects.count(), 210)
+        self.assertEqual(self.blog.last_post_id, 210)
+        self.assertEqual(self.service.client.offsets, [0])
+
+    def test_concurrent_ingest(self):
+        self.blog.posts = 120  # stale posts count, the rest should be fetched sequentially
+        self.service.client = FakeTumblrClient([make_post(i) for i in range(1, 201)])
+        self.service._ingest(self.blog, full=True)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(sorted(self.service.client.offsets), [0, 50, 100, 150, 200])
+
+    def test_chunked_ingest(self):
+        self.blog.posts = 200
+        self.service.client = FakeTumblrClient([make_post(i) for i in range(1, 211)])
+        self.service.update_chunk_size = 100
+        chunks = self.service.get_update_chunks(self.blog)
+        self.assertEqual(chunks, [(0, 100), (100, None)])
+        for start, stop in reversed(chunks):
+            self.service._ingest(self.blog, True, start, stop)
+        self.assertEqual(Post.objects.count(), 210)
+        self.assertEqual(Blog.objects.get(pk=self.blog.pk).last_post_id, 210)
+
+    def test_resume_ingest(self):
+        self.blog.posts = 200
+        self.service.fetch_retries = 0
+        posts = [make_post(i) for i in range(1, 201)]
+        self.service.client = FakeTumblrClient(posts, failing_offsets=[100])
+        with self.assertRaises(TransientTumblrError):
+            self.service._ingest(self.blog, full=True)
+        self.assertEqual(Post.objects.count(), 100)
+        self.assertIsNone(Blog.objects.get(pk=self.blog.pk).last_full_update)
+        # 10 posts published since then shift the rest of posts by 10
+        self.blog.posts = 210
+        self.service.client = FakeTumblrClient(posts + [make_post(i) for i in range(201, 211)])
+        self.service._ingest(self.blog, full=True)
+        self.assertEqual(sorted(self.service.client.offsets), [110, 160, 210])
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertIsNotNone(Blog.objects.get(pk=self.blog.pk).last_full_update)
+        self.assertFalse(UpdateCheckpoint.objects.exists())
+
+    def test_stats(self):
+        self.service._save_posts(self.blog, [
+            make_post(1, note_count=10),
+            make_post(2, note_count=30, reblogged_from_id=100),
+            make_post(3, note_count=20),
+        ])
+        StatsService().refresh_stats(self.blog)
+        user = self.blog.user
+        top = self.service.get_top_posts(user, count=1)
+        self.assertEqual(top, [{'title': 'Post 3', 'note_count': 20, 'url': 'https://test.tumblr.com/post/3/'}])
+        top = self.service.get_top_posts(user, count=5, exclude_reblogs=False)
+        self.assertEqual([p['note_count'] for p in top], [30, 20, 10])
+        self.assertEqual(self.service.get_notes_stats(user), [10, 20])
+        self.assertEqual(self.service.get_notes_stats(user, exclude_reblogs=False), [10, 30, 20])
+
+    def test_notes_buckets(self):
+        self.service._save_posts(self.blog, [make_post(i, note_count=i, timestamp=i * 10) for i in range(100)])
+        buckets = StatsService().compute_notes_buckets(self.blog, points=4, since=0, until=399)
+        self.assertEqual([b['timestamp'] for b in buckets], [0, 100, 200, 300])
+        self.assertEqual(buckets[1], {'timestamp': 100, 'posts': 10, 'min': 10, 'max': 19, 'mean': 14.5})
+        buckets = StatsService().compute_notes_buckets(self.blog, points=10)
+        self.assertEqual(sum(b['posts'] for b in buckets), 100)
+        self.assertEqual(len(buckets), 10)
+
+    def test_period_stats(self):
+        self.service._save_posts(self.blog, [
+            make_post(1, note_count=1, date='2020-05-01 12:00:00 GMT'),
+            make_post(2, note_count=5, date='2020-05-20 12:00:00 GMT', reblogged_from_id=100),
+            make_post(3, note_count=9, date='2020-05-21 12:00:00 GMT'),
+            make_post(4, note_count=4, date='2020-06-01 12:00:00 GMT'),
+        ])
+        service = AggregationService()
+        periods = service.get_period_stats(self.blog, 'month')
+        self.assertEqual(periods, [
+            {'period': '2020-05-01', 'posts': 3, 'originals': 2, 'reblogs': 1,
+             'notes': 15, 'mean_notes': 5.0, 'median_notes': 5},
+            {'period': '2020-06-01', 'posts': 1, 'originals': 1, 'reblogs': 0,
+             'notes': 4, 'mean_notes': 4.0, 'median_notes': 4},
+        ])
+        self.assertEqual(len(service.get_period_stats(self.blog, 'week')), 3)
+        summary = service.get_summary(self.blog)
+        self.assertEqual((summary['posts'], summary['notes'], summary['median_notes']), (4, 19, 4.5))
+
+    def test_tag_stats(self):
+        service = TagStatsService()
+        changed = self.service._save_posts(self.blog, [
+            make_post(1, ['a', 'b'], note_count=10),
+            make_post(2, ['a', 'b', 'c'], note_count=20),
+            make_post(3, ['a'], note_count=60),
+        ])
+        service.refresh_tags(self.blog, changed.tags)
+        tags = service.get_top_tags(self.blog)
+        self.assertEqual(tags[0], {'tag': 'a', 'posts': 3, 'notes': 90, 'mean_notes': 30.0, 'median_notes': 20})
+        pairs = service.get_top_pairs(self.blog)
+        self.assertEqual(len(pairs), 1)
+        self.assertCountEqual(pairs[0]['tags'], ['a', 'b'])
+        self.assertEqual(pairs[0]['posts'], 2)
+
+        changed = self.service._save_posts(self.blog, [make_post(2, ['c'], note_count=20)])
+        service.refresh_tags(self.blog, changed.tags)
+        self.assertEqual([t['tag'] for t in service.get_top_tags(self.blog, order='mean_notes')], ['a', 'c', 'b'])
+        self.assertEqual(service.get_top_pairs(self.blog), [])
+
+    def test_snapshots(self):
+        service = SnapshotService()
+        day = 24 * 60 * 60
+        for i, note_count in enumerate([1, 1, 2, 3, 3]):
+            changes = self.service._save_posts(self.blog, [make_post(1, note_count=note_count)])
+            service.record(self.blog, changes.note_counts, captured_at=i * day // 2)
+        post = Post.objects.get(id=1)
+        self.assertEqual(service.get_post_growth(post), [[0, 1], [day, 2], [day * 3 // 2, 3]])
+        self.assertEqual(len(service.get_blog_growth(self.blog)), 3)
+
+        with self.settings(SNAPSHOTS_DOWNSAMPLING=[(0, day)]):
+            service = SnapshotService()
+            service.prune(now=2 * day)
+        self.assertEqual(service.get_post_growth(post), [[0, 1], [day * 3 // 2, 3]])
+
+    def test_user_blogs(self):
+        other_blog = make_blog('other')
+        public = make_blog('public', is_primary=False)
+        public.watchers.add(self.blog.user, other_blog.user)
+        service = BlogsService()
+        self.assertCountEqual(service.get_user_blogs(self.blog.user), [self.blog, public])
+        self.assertCountEqual(service.get_user_blogs(other_blog.user), [other_blog, public])
+
+
+class Scheduler(TestCase):
+
+    def setUp(self):
+        reset()
+        self.blog = make_blog()
+        self.service = PostsService()
+
+    def test_scheduler_interval(self):
+        day = 24 * 60 * 60
+        now = 1000 * day
+        service = SchedulerService()
+        self.blog.last_post_timestamp = now - 100 * day
+        self.assertEqual(service.get_interval(self.blog, now), 7 * day)
+        self.blog.last_post_timestamp = now - day
+        self.assertEqual(service.get_interval(self.blog, now), day / 2)
+        self.service._save_posts(self.blog, [make_post(i, timestamp=now - i * 60 * 60) for i in range(1, 61)])
+        self.assertEqual(service.get_interval(self.blog, now), 12 * 60 * 60)
+        self.service._save_posts(self.blog, [make_post(i, timestamp=now - i * 60) for i in range(1, 3001)])
+        self.assertEqual(service.get_interval(self.blog, now), 15 * 60)
+
+    def test_scheduled_update_interval(self):
+        self.service.client = FakeTumblrClient([make_post(i) for i in range(1, 11)])
+        self.service.reset_update_interval(self.blog.blog_name)
+        # Scheduled updates don't keep user from requesting an update
+        self.service.update_posts(self.blog.user, set_interval=False)
+        self.assertEqual(Post.objects.count(), 10)
+        self.assertIsNone(self.service.check_update_interval(self.blog.blog_name))
+        self.service.update_posts(self.blog.user)
+        self.assertIsNotNone(self.service.check_update_interval(self.blog.blog_name))
+        self.service.reset_update_interval(self.blog.blog_name)
+
+    def test_scheduled_blogs(self):
+        day = 24 * 60 * 60
+        now = 1000 * day
+        other = make_blog('other', user=self.blog.user, is_primary=False, last_post_timestamp=now - 100 * day)
+        self.blog.last_post_timestamp = now - day
+        self.blog.save()
+        service = SchedulerService()
+        service.redis.delete(service.schedule_key)
+        service.sync(now)
+        self.assertCountEqual(service.pop_due(now + service.min_interval), [self.blog, other])
+        # Every blog is planned by its own activity
+        self.assertEqual(service.pop_due(now + day), [self.blog])
+        self.assertGreater(service.redis.zscore(service.schedule_key, other.pk), now + 6 * day)
+        service.redis.delete(service.schedule_key)
+
+    def test_scheduled_update_enqueue(self):
+        user_id = self.blog.user.id
+        other = make_blog('other', user=self.blog.user, is_primary=False)
+        keys = QUEUED_KEY.format(user_id), SCHEDULED_KEY.format('test'), SCHEDULED_KEY.format('other')
+        self.service.redis.delete(*keys)
+        with mock.patch.object(scheduled_update, 'send') as scheduled, \
+                mock.patch.object(update_blog_posts, 'send') as scheduled_blog, \
+                mock.patch.object(update_posts_and_blog_info, 'send') as requested:
+            self.assertTrue(enqueue_scheduled_update(self.blog))
+            self.assertFalse(enqueue_scheduled_update(self.blog))
+            self.assertTrue(enqueue_scheduled_update(other))
+            # Waiting scheduled update doesn't keep user from requesting an update
+            self.assertTrue(enqueue_update(update_posts_and_blog_info, user_id))
+        self.service.redis.delete(*keys)
+        scheduled.assert_called_once_with(user_id)
+        scheduled_blog.assert_called_once_with(user_id, 'other', False)
+        requested.assert_called_once_with(user_id, False, [])
+
+
+class MemoizedBlogs(TestCase):
+
+    def setUp(self):
+        reset()
+        self.blog = make_blog()
+
+    def test_memoized_blog(self):
+        service = BlogsService()
+        user = self.blog.user
+        with self.assertNumQueries(1):
+            self.assertEqual(service.get_user_blog(user), self.blog)
+        with self.assertNumQueries(0), request_scope():
+            service.get_user_blog(user)
+            service.get_user_blog(user)
+        ResponseCache().bump_version(self.blog.blog_name)
+        with self.assertNumQueries(1):
+            service.get_user_blog(user)
+        reset()
+        with self.assertNumQueries(1):
+            service.get_user_blog(user)
+        # Unknown blogs are not fetched from Tumblr unless asked to
+        with self.assertNumQueries(1), self.assertRaises(Blog.DoesNotExist):
+            service.get_user_blog(user, 'unknown')
+
+
+class Export(TestCase):
+
+    def setUp(self):
+        self.blog = make_blog()
+        self.service = PostsService()
+
+    def test_export(self):
+        self.service._save_posts(self.blog, [make_post(i, ['a', f'tag{i}'], note_count=i) for i in range(1, 6)])
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            parts = list(ExportService().export(self.blog, 'tags', 'csv'))
+        self.assertEqual(len(parts), 6)
+        lines = b''.join(parts).decode().splitlines()
+        self.assertEqual(lines[0], 'post_id,tag')
+        self.assertEqual(len(lines), 11)
+        self.assertIn('3,tag3', lines)
+
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_export_parquet(self):
+        import pyarrow.parquet
+        self.service._save_posts(self.blog, [make_post(i, note_count=i) for i in range(1, 6)])
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            data = b''.join(ExportService().export(self.blog, 'posts', 'parquet'))
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(data))
+        self.assertEqual(table.column('note_count').to_pylist(), [1, 2, 3, 4, 5])
+        self.assertEqual(pyarrow.parquet.ParquetFile(pyarrow.BufferReader(data)).num_row_groups, 3)
+
+
+class ImportPosts(TestCase):
+
+    def setUp(self):
+        self.blog = make_blog()
+        self.service = PostsService()
+
+    def test_import_posts(self):
+        pages = [{'response': {'posts': [make_post(i, ['a']) for i in range(p * 3 + 1, p * 3 + 4)]}} for p in range(4)]
+        pages[0]['response']['posts'].append(make_post(100, blog_name='other'))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'posts.jsonl')
+            with open(path, 'w') as f:
+                f.writelines(json.dumps(page) + '\n' for page in pages)
+            batches = list(DumpReader(path, 'test', processes=2, batch_size=1).read())
+        self.assertEqual([[p['id'] for p in batch] for batch in batches], [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10, 11, 12]])
+        self.assertEqual(self.service.import_posts(self.blog, batches), 12)
+        self.assertEqual(Post.objects.filter(blog=self.blog).count(), 12)
+        self.assertEqual(self.blog.last_post_id, 12)
+        self.assertEqual(TagStatsService().get_top_tags(self.blog)[0]['posts'], 12)
+
+
+class WatchedBlogViews(TestCase):
+
+    def setUp(self):
+        reset()
+        user = make_blog('owner').user
+        self.public = make_blog('public', is_primary=False)
+        self.public.watchers.add(user)
+        for blog in ('owner', 'public'):
+            ResponseCache().bump_version(blog)
+        PostsService()._save_posts(self.public, [make_post(1, ['a'], note_count=5)])
+        TagStatsService().refresh_blog(self.public)
+        self.client.force_login(user)
+
+    def test_watched_blog_stats(self):
+        tags = json.loads(self.client.get('/api/tags/?blog=public').content)
+        self.assertEqual([t['tag'] for t in tags['tags']], ['a'])
+        self.assertEqual(json.loads(self.client.get('/api/tags/').content)['tags'], [])
+        stats = json.loads(self.client.get('/api/stats/?blog=public').content)
+        self.assertEqual(stats['summary']['posts'], 1)
+        self.assertEqual(self.client.get('/api/growth/?post=1').status_code, 200)
+        self.assertEqual(self.client.get('/api/growth/?post=2').status_code, 404)
+        PostsService()._save_posts(make_blog('stranger'), [make_post(3)])
+        self.assertEqual(self.client.get('/api/growth/?post=3').status_code, 404)
+        self.assertEqual(self.client.get('/api/growth/?post=first').status_code, 400)
+        self.assertEqual(self.client.get('/api/stats/?blog=unknown').status_code, 404)
+
+    def test_watched_post_growth_cache(self):
+        user = get_user_model().objects.get(username='owner')
+        self.assertEqual(self.client.get('/api/growth/?post=1').status_code, 200)
+        # History of the post is cached along with data of its blog, not of the primary one
+        cache = ResponseCache()
+        path = '%s:/api/growth/?post=1' % user.pk
+        self.assertIsNotNone(cache.get('public', cache.get_version('public'), path))
+        self.assertIsNone(cache.get('owner', cache.get_version('owner'), path))
+
+    def test_watched_blog_status_stream(self):
+        ProgressService().finish('public')
+        response = self.client.get('/api/update_status/stream/?blog=public')
+        self.assertIn(b'event: end', b''.join(response.streaming_content))
+        self.assertEqual(self.client.get('/api/update_status/stream/?blog=unknown').status_code, 404)
+
+
+class ChunkedUpdate(TestCase):
+
+    def setUp(self):
+        reset()
+        self.blog = make_blog(posts=200)
+        # Primary keys are reused between test runs, so counters of earlier runs are dropped
+        service = PostsService()
+        service.redis.delete(service.chunks_key.format(self.blog.pk), service.chunks_failed_key.format(self.blog.pk))
+
+    def test_failed_chunk(self):
+        client = FakeTumblrClient([make_post(i) for i in range(1, 201)], failing_offsets=[150])
+        service = PostsService()
+        service.start_chunked_update(self.blog, 2)
+        with mock.patch('tumblr_posts.services.tumblr.AuthService.get_api_client', return_value=client), \
+                self.settings(TUMBLR_FETCH_BACKOFF=0):
+            update_posts_chunk(self.blog.user.id, 'test', 0, 100)
+            self.assertEqual(ProgressService().get_progress('test')['state'], ProgressService.RUNNING)
+            with self.assertRaises(TransientTumblrError):
+                update_posts_chunk(self.blog.user.id, 'test', 100, None)
+        # The update is finished without the failed part, but it's not counted as a full update
+        self.assertEqual(ProgressService().get_progress('test')['state'], ProgressService.FAILED)
+        self.assertIsNone(service.check_update_interval('test'))
+        self.assertEqual(Post.objects.count(), 150)
+        self.assertTrue(BlogStats.objects.filter(blog=self.blog).exists())
+        self.assertIsNone(Blog.objects.get(pk=self.blog.pk).last_full_update)
+        self.assertFalse(service.redis.exists(service.chunks_key.format(self.blog.pk)))
+
+    def test_chunked_update_running(self):
+        service = PostsService()
+        self.assertTrue(service.start_chunked_update(self.blog, 2))
+        # Parts of the running update would be counted twice otherwise
+        self.assertFalse(service.start_chunked_update(self.blog, 3))
+        self.assertEqual(int(service.redis.get(service.chunks_key.format(self.blog.pk))), 2)
+        service.drop_posts_chunk(self.blog.user, 'test')
+        service.drop_posts_chunk(self.blog.user, 'test')
+        self.assertTrue(service.start_chunked_update(self.blog, 2))
+
+    def test_long_chunk_not_cut_off(self):
+        time_limit = next(m for m in dramatiq.get_broker().middleware if isinstance(m, TimeLimit))
+        message = update_posts_chunk.message(self.blog.user.id, 'test', 0, 100)
+        time_limit.before_process_message(dramatiq.get_broker(), message)
+        try:
+            # Past the default limit of TimeLimit middleware, but within the limit of update jobs
+            with mock.patch('dramatiq.middleware.time_limit.monotonic', return_value=monotonic() + 60 * 60), \
+                    mock.patch('dramatiq.middleware.time_limit.raise_thread_exception') as raise_exception:
+                time_limit._handle()
+            raise_exception.assert_not_called()
+        finally:
+            time_limit.after_process_message(dramatiq.get_broker(), message)
+
+
+class UpdateTasks(TestCase):
+
+    def setUp(self):
+        reset()
+        self.blog = make_blog()
+
+    def test_primary_blog_rate_limited(self):
+        user_id = self.blog.user.id
+        with mock.patch.object(BlogsService, 'update_user_info'), \
+                mock.patch('tumblr_posts.tasks._update_blog', side_effect=RateLimitExceeded(30)), \
+                mock.patch.object(update_blog_posts, 'send_with_options') as rescheduled_blog, \
+                mock.patch.object(update_posts_and_blog_info, 'send_with_options') as rescheduled:
+            _update(update_posts_and_blog_info, user_id, True, [])
+        # Only posts of the primary blog are updated again
+        rescheduled_blog.assert_called_once_with(args=(user_id, 'test', True), delay=30000)
+        rescheduled.assert_not_called()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are checked on PostgreSQL only')
+class QueryPlans(TestCase):
+
+    def setUp(self):
+        self.blog = make_blog()
+        with connection.cursor() as cursor:
+            # Tables are tiny in tests, so planner would choose sequential scans and sorts otherwise.
+            # Settings are local to the transaction of the test, so they don't affect other tests
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+
+    def test_top_posts_plan(self):
+        plan = Post.objects.filter(blog=self.blog, is_reblog=False).order_by('-note_count')[:50].explain()
+        self.assertIn('post_blog_reblog_notes_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_notes_plan(self):
+        plan = Post.objects.filter(blog=self.blog).order_by('timestamp').values('note_count').explain()
+        self.assertIn('post_blog_timestamp_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_blog_name_plan(self):
+        plan = Blog.objects.filter(blog_name='test').explain()
+        self.assertIn('Index', plan)
@@ -6,4 +6,10 @@ urlpatterns = [
     path('request_update/', views.RequestUpdateView.as_view()),
     path('top/', views.TopPostsView.as_view()),
     path('note_graph/', views.NoteGraphView.as_view()),
+    path('stats/', views.PeriodStatsView.as_view()),
+    path('tags/', views.TagStatsView.as_view()),
+    path('growth/', views.GrowthView.as_view()),
+    path('update_status/', views.UpdateStatusView.as_view()),
+    path('update_status/stream/', views.UpdateStatusStreamView.as_view()),
+    path('export/', views.ExportView.as_view()),
 ]
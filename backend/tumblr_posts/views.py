@@ -1,11 +1,23 @@
+import asyncio
 import json
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.views import View
-from backend.utils import login_required
-from tumblr_posts.tasks import update_posts_and_blog_info
-from tumblr_posts.services.tumblr import PostsService
+from backend.cache import cache_json_response
+from backend.streaming import AsyncStreamingHttpResponse
+from backend.utils import AsyncView, login_required
+from tumblr_posts.tasks import enqueue_update, update_posts_and_blog_info
+from tumblr_posts.services.aggregation import AggregationService
+from tumblr_posts.services.export import ExportService
+from tumblr_posts.services.progress import ProgressService
+from tumblr_posts.models import Blog, Post
+from tumblr_posts.services.snapshots import SnapshotService
+from tumblr_posts.services.tags import TagStatsService
+from tumblr_posts.services.tumblr import PostsService, BlogsService
 from django.template.response import TemplateResponse
-from django.http import HttpResponse
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.http import HttpResponseBadRequest, HttpResponseNotFound
 
 
 class IndexView(View):
@@ -20,36 +32,264 @@ class RequestUpdateView(View):
     """
     Requests posts update for authorized user.
     User don't wait until posts is updated, it's being updated in background.
+    If `all` is given, all blogs of the user are updated. Public blogs of other users
+    given by `blog` parameters are added to watched blogs and updated too
     """
     @login_required
     def get(self, request):
         blog_name = request.user.username
+        public_blogs = request.GET.getlist('blog')
+        if len(public_blogs) > settings.UPDATE_MAX_PUBLIC_BLOGS:
+            return HttpResponseBadRequest('At most %d blogs can be requested' % settings.UPDATE_MAX_PUBLIC_BLOGS)
         interval = PostsService().check_update_interval(blog_name)
         if not interval:
-            update_posts_and_blog_info.send(request.user.id)
+            if enqueue_update(update_posts_and_blog_info, request.user.id, 'all' in request.GET, public_blogs):
+                ProgressService().queue(blog_name)
             return HttpResponse('Update was requested.')
         else:
             return HttpResponse("Next update request is available in %d seconds" % interval, status=429)
 
 
-class TopPostsView(View):
+class TopPostsView(AsyncView):
     """
-    API endpoint to get top posts in JSON format
+    API endpoint to get top posts of the blog given by `blog` (primary blog by default) in JSON format
     """
     @login_required
-    def get(self, request):
-        count = request.GET.get('count', 5)
+    @cache_json_response
+    async def get(self, request):
+        try:
+            count = int(request.GET.get('count', 5))
+        except ValueError:
+            return HttpResponseBadRequest('Count must be an integer')
         if not (0 < count <= 50):
             return HttpResponseBadRequest('Count must be within 1..50')
-        posts = PostsService().get_top_posts(request.user, count=count)
+        try:
+            posts = await sync_to_async(PostsService().get_top_posts)(request.user, request.GET.get('blog'),
+                                                                      count=count)
+        except Blog.DoesNotExist:
+            return HttpResponseNotFound('Blog not found')
         return HttpResponse(json.dumps(posts, ensure_ascii=False), content_type="application/json")
 
 
-class NoteGraphView(View):
+class NoteGraphView(AsyncView):
     """
-    API endpoint to get statistics about notes count on all posts
+    API endpoint to get statistics about notes count on all posts of the blog given by `blog`
+    (primary blog by default).
+    If time range (`since`, `until`) or `points` is given, returns the graph downsampled
+    to at most `points` time buckets within the range
     """
     @login_required
-    def get(self, request):
-        statistics = PostsService().get_notes_stats(request.user)
+    @cache_json_response
+    async def get(self, request):
+        params = {}
+        for name in ('since', 'until', 'points'):
+            if name in request.GET:
+                try:
+                    params[name] = int(request.GET[name])
+                except ValueError:
+                    return HttpResponseBadRequest('%s must be an integer' % name.capitalize())
+        if not (0 < params.get('points', 1) <= settings.NOTE_GRAPH_MAX_POINTS):
+            return HttpResponseBadRequest('Points must be within 1..%d' % settings.NOTE_GRAPH_MAX_POINTS)
+        blog_name = request.GET.get('blog')
+        try:
+            if not params:
+                statistics = await sync_to_async(PostsService().get_notes_stats)(request.user, blog_name)
+            else:
+                statistics = await sync_to_async(PostsService().get_notes_graph)(request.user, blog_name, **params)
+        except Blog.DoesNotExist:
+            return HttpResponseNotFound('Blog not found')
+        return HttpResponse(json.dumps(statistics), content_type="application/json")
+
+
+class PeriodStatsView(AsyncView):
+    """
+    API endpoint to get posts and notes statistics per day, week or month of the blog given by `blog`
+    (primary blog by default)
+    """
+    @login_required
+    @cache_json_response
+    async def get(self, request):
+        period = request.GET.get('period', 'month')
+        if period not in AggregationService.PERIODS:
+            return HttpResponseBadRequest('Period must be one of: %s' % ', '.join(AggregationService.PERIODS))
+        try:
+            statistics = await sync_to_async(self._get_statistics)(request.user, request.GET.get('blog'), period)
+        except Blog.DoesNotExist:
+            return HttpResponseNotFound('Blog not found')
         return HttpResponse(json.dumps(statistics), content_type="application/json")
+
+    @staticmethod
+    def _get_statistics(user, blog_name, period):
+        blog = BlogsService().get_user_blog(user, blog_name)
+        service = AggregationService()
+        return {
+            'summary': service.get_summary(blog),
+            'periods': service.get_period_stats(blog, period),
+        }
+
+
+class TagStatsView(AsyncView):
+    """
+    API endpoint to get best performing tags and tags most often used together in the blog given by `blog`
+    (primary blog by default)
+    """
+    @login_required
+    @cache_json_response
+    async def get(self, request):
+        order = request.GET.get('order', 'posts')
+        if order not in TagStatsService.ORDERS:
+            return HttpResponseBadRequest('Order must be one of: %s' % ', '.join(TagStatsService.ORDERS))
+        try:
+            count = int(request.GET.get('count', 20))
+        except ValueError:
+            return HttpResponseBadRequest('Count must be an integer')
+        if not (0 < count <= 100):
+            return HttpResponseBadRequest('Count must be within 1..100')
+        try:
+            statistics = await sync_to_async(self._get_statistics)(request.user, request.GET.get('blog'), order, count)
+        except Blog.DoesNotExist:
+            return HttpResponseNotFound('Blog not found')
+        return HttpResponse(json.dumps(statistics, ensure_ascii=False), content_type="application/json")
+
+    @staticmethod
+    def _get_statistics(user, blog_name, order, count):
+        blog = BlogsService().get_user_blog(user, blog_name)
+        service = TagStatsService()
+        return {
+            'tags': service.get_top_tags(blog, order, count),
+            'pairs': service.get_top_pairs(blog, count),
+        }
+
+
+class GrowthView(AsyncView):
+    """
+    API endpoint to get history of notes count of a post (if `post` is given) or of the whole blog given by `blog`
+    (primary blog by default)
+    """
+    @login_required
+    @cache_json_response
+    async def get(self, request):
+        post_id = request.GET.get('post')
+        if post_id is not None:
+            try:
+                post_id = int(post_id)
+            except ValueError:
+                return HttpResponseBadRequest('Post must be an integer')
+        try:
+            growth = await sync_to_async(self._get_growth)(request.user, request.GET.get('blog'), post_id)
+        except Post.DoesNotExist:
+            return HttpResponseNotFound('Post not found')
+        except Blog.DoesNotExist:
+            return HttpResponseNotFound('Blog not found')
+        return HttpResponse(json.dumps(growth), content_type="application/json")
+
+    @staticmethod
+    def get_cache_blog_name(request):
+        post_id = request.GET.get('post')
+        if post_id is None:
+            return request.GET.get('blog') or request.user.username
+        # History of a post changes along with data of its blog, which may be a watched one
+        try:
+            return Post.objects.filter(id=int(post_id), blog__in=BlogsService().get_user_blogs(request.user)) \
+                .values_list('blog__blog_name', flat=True).first()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _get_growth(user, blog_name, post_id):
+        service = SnapshotService()
+        if post_id is not None:
+            post = Post.objects.get(id=post_id, blog__in=BlogsService().get_user_blogs(user))
+            return service.get_post_growth(post)
+        return service.get_blog_growth(BlogsService().get_user_blog(user, blog_name))
+
+
+async def _get_progress_blog_name(request):
+    """
+    Get name of the blog given by `blog` (primary blog by default) whose update progress is requested
+
+    :param request: request
+    :return: blog name or None if the user has no access to the blog
+    """
+    blog_name = request.GET.get('blog') or request.user.username
+    if blog_name != request.user.username:
+        try:
+            await sync_to_async(BlogsService().get_user_blog)(request.user, blog_name)
+        except Blog.DoesNotExist:
+            return None
+    return blog_name
+
+
+class UpdateStatusView(AsyncView):
+    """
+    API endpoint to get progress of the latest posts update of the blog given by `blog`
+    (primary blog by default). Progress of the primary blog is read from Redis only,
+    so it's cheap enough to be polled while waiting for the update
+    """
+    @login_required
+    async def get(self, request):
+        blog_name = await _get_progress_blog_name(request)
+        if blog_name is None:
+            return HttpResponseNotFound('Blog not found')
+        progress = await sync_to_async(ProgressService().get_progress, thread_sensitive=False)(blog_name)
+        return HttpResponse(json.dumps(progress), content_type="application/json")
+
+
+class UpdateStatusStreamView(AsyncView):
+    """
+    API endpoint streaming progress of the latest posts update of the blog given by `blog`
+    (primary blog by default) as Server-Sent Events.
+    Event is sent every time progress changes. When the update is finished `end` event is sent,
+    client should close EventSource on it. Otherwise the stream is closed after UPDATE_STATUS_STREAM_TIMEOUT
+    and EventSource reconnects by itself
+    """
+    @login_required
+    async def get(self, request):
+        blog_name = await _get_progress_blog_name(request)
+        if blog_name is None:
+            return HttpResponseNotFound('Blog not found')
+        response = AsyncStreamingHttpResponse(self._events(blog_name), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer events
+        return response
+
+    @staticmethod
+    async def _events(blog_name):
+        get_progress = sync_to_async(ProgressService().get_progress, thread_sensitive=False)
+        deadline = time.monotonic() + settings.UPDATE_STATUS_STREAM_TIMEOUT
+        last = None
+        yield 'retry: %d\n\n' % (settings.UPDATE_STATUS_STREAM_INTERVAL * 1000)
+        while time.monotonic() < deadline:
+            progress = await get_progress(blog_name)
+            if progress != last:
+                yield 'data: %s\n\n' % json.dumps(progress)
+                last = progress
+            if progress is not None and progress['state'] in ProgressService.FINAL_STATES:
+                yield 'event: end\ndata: %s\n\n' % json.dumps(progress['state'])
+                return
+            await asyncio.sleep(settings.UPDATE_STATUS_STREAM_INTERVAL)
+
+
+class ExportView(View):
+    """
+    API endpoint streaming `dataset` (posts, tags or notes history) of the blog given by `blog`
+    (primary blog by default) as a file in `format` (csv, parquet or arrow)
+    """
+    @login_required
+    def get(self, request):
+        dataset = request.GET.get('dataset', 'posts')
+        if dataset not in ExportService.DATASETS:
+            return HttpResponseBadRequest('Dataset must be one of: %s' % ', '.join(ExportService.DATASETS))
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in ExportService.FORMATS:
+            return HttpResponseBadRequest('Format must be one of: %s' % ', '.join(ExportService.FORMATS))
+        if not ExportService.is_available(fmt):
+            return HttpResponseBadRequest('Format %s is not supported by the server' % fmt)
+        try:
+            blog = BlogsService().get_user_blog(request.user, request.GET.get('blog'))
+        except Blog.DoesNotExist:
+            return HttpResponseNotFound('Blog not found')
+        response = StreamingHttpResponse(ExportService().export(blog, dataset, fmt),
+                                         content_type=ExportService.CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = 'attachment; filename="%s-%s.%s"' % (blog.blog_name, dataset, fmt)
+        return response